@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+def bin_rows(bins):
+    '''
+    Distinct rows of the key columns bins, sorted by key, and the index of every row's bin among them.
+    Each key column is factorized on its own, the column codes are combined into a single int64 code with
+    np.ravel_multi_index and only that 1-D code is made unique.
+    '''
+    if bins.shape[1] == 0:
+        return np.empty((min(len(bins), 1), 0)), np.zeros(len(bins), dtype=np.int64)
+
+    levels          = [pd.factorize(col, sort=True) for col in bins.T]
+    shape           = [max(len(unique), 1) for _, unique in levels]
+    code            = np.ravel_multi_index([codes for codes, _ in levels], shape)
+    inverse, unique = pd.factorize(code, sort=True)
+    bins            = np.column_stack([level[index] for (_, level), index in zip(levels, np.unravel_index(unique, shape))])
+
+    return bins.reshape(len(unique), len(levels)), inverse
+
+class OperatingPoints:
+    '''
+    Streaming per bin statistics, binned on the key columns: the sample count, the count and sum of every value column,
+    and the sum of squares, min and max of the value columns named in spread. Each chunk is reduced to its own bins and merged into the bins seen so far, and the
+    statistics of other chunks, files or worker processes can be merged in the same way, so only the per bin
+    statistics are kept between chunks.
+    '''
+    def __init__(self, keys, values, spread=()):
+        self.keys       = list(keys)
+        self.values     = list(values)
+        self.spread     = list(spread)
+        self.bins       = np.empty((0, len(self.keys)))
+        self.samples    = np.empty(0)
+        self.count      = np.empty((0, len(self.values)))
+        self.sum        = np.empty((0, len(self.values)))
+        self.sum_sq     = np.empty((0, len(self.spread)))
+        self.min        = np.empty((0, len(self.spread)))
+        self.max        = np.empty((0, len(self.spread)))
+
+    def update(self, bins, values):
+        '''
+        Fold in a chunk of rows, given as a 2-D array of its key columns and a 2-D array of its value columns
+        '''
+        bins    = np.asarray(bins, dtype=float)
+        values  = np.asarray(values, dtype=float)
+
+        #Rows without a bin are dropped, NaN values are left out of their column's statistics like pandas' mean
+        binned  = ~np.isnan(bins).any(axis=1)
+        if not binned.all():
+            bins    = bins[binned]
+            values  = values[binned]
+
+        chunk                   = OperatingPoints(self.keys, self.values, self.spread)
+        chunk.bins, inverse     = bin_rows(bins)
+        n_bins                  = len(chunk.bins)
+        chunk.samples           = np.bincount(inverse, minlength=n_bins).astype(float)
+        chunk.count             = np.zeros((n_bins, len(self.values)))
+        chunk.sum               = np.zeros((n_bins, len(self.values)))
+        chunk.sum_sq            = np.zeros((n_bins, len(self.spread)))
+        chunk.min               = np.full((n_bins, len(self.spread)), np.nan)
+        chunk.max               = np.full((n_bins, len(self.spread)), np.nan)
+
+        filled = []
+        for col in range(len(self.values)):
+            column  = values[:, col]
+            missing = np.isnan(column)
+            if missing.any():
+                chunk.count[:, col] = chunk.samples - np.bincount(inverse[missing], minlength=n_bins)
+                column              = np.where(missing, 0, column)
+            else:
+                chunk.count[:, col] = chunk.samples
+            chunk.sum[:, col] = np.bincount(inverse, weights=column, minlength=n_bins)
+            filled.append(column)
+
+        #The spread columns' min and max are reduced over the rows sorted by bin, NaN values are skipped by fmin and fmax
+        if self.spread and n_bins > 0:
+            #Stable sorts of 16 bit integers are radix sorts, so the usual few hundred bins sort in linear time
+            order   = np.argsort(inverse.astype(np.int16) if n_bins <= np.iinfo(np.int16).max else inverse, kind="stable")
+            starts  = np.searchsorted(inverse[order], np.arange(n_bins))
+            for col, name in enumerate(self.spread):
+                column                  = values[:, self.values.index(name)]
+                square                  = filled[self.values.index(name)]**2
+                chunk.sum_sq[:, col]    = np.bincount(inverse, weights=square, minlength=n_bins)
+                chunk.min[:, col]       = np.fmin.reduceat(column[order], starts)
+                chunk.max[:, col]       = np.fmax.reduceat(column[order], starts)
+
+        self.merge(chunk)
+
+    def merge(self, other):
+        '''
+        Merge in the statistics of another OperatingPoints with the same key, value and spread columns
+        '''
+        bins, inverse   = bin_rows(np.concatenate([self.bins, other.bins]))
+        n_bins          = len(bins)
+
+        def add(current, new):
+            stacked = np.concatenate([current, new])
+            if stacked.ndim == 1:
+                return np.bincount(inverse, weights=stacked, minlength=n_bins)
+            total = np.zeros((n_bins, stacked.shape[1]))
+            for col in range(stacked.shape[1]):
+                total[:, col] = np.bincount(inverse, weights=stacked[:, col], minlength=n_bins)
+            return total
+
+        #Both sides hold one row per bin, so these run over the bins rather than the samples
+        minimum = np.full((n_bins, len(self.spread)), np.nan)
+        maximum = np.full((n_bins, len(self.spread)), np.nan)
+        np.fmin.at(minimum, inverse, np.concatenate([self.min, other.min]))
+        np.fmax.at(maximum, inverse, np.concatenate([self.max, other.max]))
+
+        self.samples    = add(self.samples, other.samples)
+        self.count      = add(self.count, other.count)
+        self.sum        = add(self.sum, other.sum)
+        self.sum_sq     = add(self.sum_sq, other.sum_sq)
+        self.min        = minimum
+        self.max        = maximum
+        self.bins       = bins
+
+    def to_frame(self):
+        '''
+        One row per bin, sorted by key: the key columns and the mean of every value column
+        '''
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum / self.count
+
+        df = pd.DataFrame(self.bins, columns=self.keys)
+        for col, name in enumerate(self.values):
+            df[name] = mean[:, col]
+
+        return df
+
+    def statistics(self):
+        '''
+        One row per bin, sorted by key: the key columns, the number of samples in the bin and the
+        standard deviation (ddof=1, as pandas' std), minimum and maximum of every spread column
+        '''
+        df              = pd.DataFrame(self.bins, columns=self.keys)
+        df["Samples"]   = self.samples.astype(np.int64)
+        for col, name in enumerate(self.spread):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                count       = self.count[:, self.values.index(name)]
+                total       = self.sum[:, self.values.index(name)]
+                variance    = (self.sum_sq[:, col] - total**2 / count) / (count - 1)
+            df[name + " Std"] = np.where(count > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+            df[name + " Min"] = self.min[:, col]
+            df[name + " Max"] = self.max[:, col]
+
+        return df
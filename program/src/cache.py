@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+cache_dir           = os.path.join(os.path.expanduser("~"), ".torque_accuracy_tool", "cache")
+cache_limit_bytes   = 2 * 1024**3
+
+#Content digests of the uploads seen by this process, keyed by (name, size, upload id)
+_upload_digests     = dict()
+
+def content_digest(f):
+    '''
+    Hash the bytes of a file
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    f.seek(0)
+    for block in iter(lambda: f.read(1 << 20), b""):
+        digest.update(block)
+    f.seek(0)
+
+    return digest.hexdigest()
+
+def file_digest(f):
+    '''
+    Cache key of an uploaded file: its content digest, which is only computed the first time an upload is seen.
+    Files without an upload id (e.g. BytesIO) are always hashed.
+    '''
+    file_id = getattr(f, "file_id", None)
+    if file_id is None:
+        return content_digest(f)
+
+    upload = (getattr(f, "name", None), getattr(f, "size", None), file_id)
+    if upload not in _upload_digests:
+        _upload_digests[upload] = content_digest(f)
+
+    return _upload_digests[upload]
+
+def _entry_path(digest):
+    return os.path.join(cache_dir, digest)
+
+def _column_file(col):
+    # Named by the column's name, so sessions adding different columns of a file never write to the same file
+    return hashlib.blake2b(str(col).encode(), digest_size=16).hexdigest() + ".npy"
+
+def _temp_path(path):
+    # Unique per process and thread, the finished file is then moved into place in one step
+    return path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+def _read_manifest(digest):
+    try:
+        with open(os.path.join(_entry_path(digest), "manifest.json")) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(digest, manifest):
+    path = os.path.join(_entry_path(digest), "manifest.json")
+    with open(_temp_path(path), "w") as tmp:
+        json.dump(manifest, tmp)
+    os.replace(_temp_path(path), path)
+
+def cache_load(digest, usecols=None):
+    '''
+    Return the header of a cached file and a dict of whichever requested columns are cached.
+    The header is None if the file has never been cached.
+    '''
+    manifest = _read_manifest(digest)
+    if manifest is None:
+        return None, {}
+
+    if usecols is None:
+        usecols = manifest["header"]
+
+    dtypes  = manifest.get("dtypes", {})
+    columns = dict()
+    for col in usecols:
+        if col in manifest["columns"]:
+            try:
+                values = np.load(os.path.join(_entry_path(digest), manifest["columns"][col]))
+            except (OSError, ValueError):
+                continue
+            if dtypes.get(col) == "datetime64[ns]":
+                values = values.view("datetime64[ns]")
+            elif dtypes.get(col) == "bytes":
+                values = values.astype(str).astype(object)
+            elif dtypes.get(col) == "str":
+                values = values.astype(object)
+            columns[col] = values
+
+    #Refresh the entry's access time for LRU eviction
+    os.utime(os.path.join(_entry_path(digest), "manifest.json"))
+
+    return manifest["header"], columns
+
+def cache_store(digest, df, header):
+    '''
+    Add the columns of df to the cache entry of a file, then evict least recently used entries over the size limit.
+    Numeric columns are stored as is, datetimes as int64 nanoseconds and text (e.g. CSV timestamps) as fixed width
+    ASCII bytes, or fixed width unicode strings when the text is not ASCII.
+    Columns of mixed types are not cached and are parsed again when requested.
+    '''
+    entry = _entry_path(digest)
+    os.makedirs(entry, exist_ok=True)
+
+    manifest = _read_manifest(digest) or {"rows": len(df), "header": list(header), "columns": {}}
+    if manifest["rows"] != len(df):
+        return
+
+    stored = dict()
+    dtypes = dict()
+    for col in df.columns:
+        if col in manifest["columns"]:
+            continue
+        values = df[col]
+        if values.dtype.kind in "biuf":
+            values = values.to_numpy()
+        elif values.dtype.kind == "M" and values.dt.tz is None:
+            values          = values.to_numpy().astype("datetime64[ns]").view(np.int64)
+            dtypes[col]     = "datetime64[ns]"
+        elif values.dtype.kind == "O" and pd.api.types.infer_dtype(values, skipna=False) == "string":
+            values = values.to_numpy().astype(str)
+            try:
+                values          = values.astype("S")
+                dtypes[col]     = "bytes"
+            except UnicodeEncodeError:
+                dtypes[col]     = "str"
+        else:
+            continue
+        path = os.path.join(entry, _column_file(col))
+        with open(_temp_path(path), "wb") as column_file:
+            np.save(column_file, values)
+        os.replace(_temp_path(path), path)
+        stored[col] = _column_file(col)
+
+    #Columns another session stored meanwhile are kept: the manifest is read again just before it is replaced
+    manifest = _read_manifest(digest) or manifest
+    manifest["columns"].update(stored)
+    manifest.setdefault("dtypes", {}).update(dtypes)
+    _write_manifest(digest, manifest)
+    cache_evict(cache_limit_bytes)
+
+def cache_evict(limit_bytes):
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for digest in os.listdir(cache_dir):
+        entry = _entry_path(digest)
+        try:
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            used = os.path.getmtime(os.path.join(entry, "manifest.json"))
+        except OSError:
+            continue
+        entries.append((used, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for used, size, entry in sorted(entries):
+        if total <= limit_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -1,4 +1,3 @@
-import streamlit as st
 from palettable.cartocolors.qualitative import Pastel_10,   Antique_10, Bold_10,        Prism_10,   Safe_10,        Vivid_10
 from palettable.colorbrewer.qualitative import Accent_8,    Paired_12,  Pastel2_8,      Set3_12,    Set2_8,         Set1_9,         Pastel2_8,      Pastel1_9
 from palettable.tableau                 import BlueRed_6,   BlueRed_12, ColorBlind_10,  Gray_5,     GreenOrange_6,  GreenOrange_12, PurpleGray_6,   PurpleGray_12,  Tableau_10, Tableau_20, TableauLight_10,    TableauMedium_10,   TrafficLight_9
@@ -9,6 +8,7 @@ from palettable.matplotlib              import Inferno_20,  Magma_20,   Plasma_2
 from palettable.colorbrewer.sequential  import Blues_9,     BuGn_9,     BuPu_9,         GnBu_9,     Greens_9,       Greys_9,        OrRd_9,         Oranges_9,      PuBu_9,     PuBuGn_9,   PuRd_9,             Purples_9,           RdPu_9, Reds_9,YlGn_9,YlGnBu_9,YlOrBr_9
 import plotly.graph_objects as go
 import plotly.express as px
+from src.fingerprint import memoize
 
 RGB_map =      [[0.0,   "rgb(0, 0, 202)"],
                 [0.1,   "rgb(0, 0, 224)"],
@@ -21,7 +21,7 @@ RGB_map =      [[0.0,   "rgb(0, 0, 202)"],
                 [0.8,   "rgb(224, 0, 0)"],
                 [1.0,   "rgb(247, 0, 0)"]]
 
-@st.cache
+@memoize
 def qualitive_color_dict():
     """
     Qualitive Color Dictionary
@@ -59,7 +59,7 @@ def qualitive_color_dict():
                         })       
     return color_dict
 
-@st.cache
+@memoize
 def diverging_color_dict():
     """
     Diverging Color Dictionary
@@ -92,7 +92,7 @@ def diverging_color_dict():
                         })                   
     return color_dict
 
-@st.cache
+@memoize
 def sequential_color_dict():
     """
     Sequential_color_set Color Dictionary
@@ -124,7 +124,7 @@ def sequential_color_dict():
                         })          
     return color_dict
 
-@st.cache
+@memoize
 def plot_color_set(color_palaette, color_set):
     """
     Plot color pallete as Bar chart for previewing.
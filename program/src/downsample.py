@@ -0,0 +1,73 @@
+import numpy as np
+
+#Upper bound on the points sent to the browser per trace
+max_points = 2000
+
+def lttb(x, y, n_out=max_points):
+    '''
+    Largest-Triangle-Three-Buckets: indices of n_out points that keep the visual shape of y against x, including peaks and step edges.
+    The first and last points are always kept, every bucket in between contributes the point forming the largest triangle
+    with the previously kept point and the average of the next bucket.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    edges       = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected    = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    a           = 0
+
+    for bucket in range(n_out - 2):
+        lo, hi  = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x, next_y = np.nanmean(x[hi : edges[bucket + 2]]), np.nanmean(y[hi : edges[bucket + 2]])
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+
+        area    = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a       = lo + np.argmax(np.nan_to_num(area, nan=-1))
+        selected[bucket + 1] = a
+
+    selected[-1] = n - 1
+
+    return selected
+
+def pixel_dedupe(x, y, width=100, height=60):
+    '''
+    Indices keeping one point per cell of a width x height grid over the plot, roughly one marker across,
+    for scatter overlays where overdrawn points add nothing. At most width x height points are kept.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if len(x) <= max_points:
+        return np.arange(len(x))
+
+    def pixel(values, size):
+        lo, hi = np.nanmin(values), np.nanmax(values)
+        if not hi > lo:
+            return np.zeros(len(values), dtype=int)
+        return np.clip(((values - lo) / (hi - lo) * (size - 1)).astype(int), 0, size - 1)
+
+    finite  = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    cells   = pixel(x[finite], width) * height + pixel(y[finite], height)
+
+    return np.sort(finite[np.unique(cells, return_index=True)[1]])
+
+def density_grid(x, y, bins=(300, 200), range=None):
+    '''
+    2D histogram of the points for a density heatmap, so the cost of drawing depends on the bins rather than the samples.
+    Returns the bin centres and the counts indexed [y, x], with empty bins as NaN so they are drawn transparent.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    finite                      = np.isfinite(x) & np.isfinite(y)
+    counts, x_edges, y_edges    = np.histogram2d(x[finite], y[finite], bins=bins, range=range)
+    counts[counts == 0]         = np.nan
+
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T
@@ -0,0 +1,97 @@
+import hashlib
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+#Results kept per memoized function and session
+memo_size = 16
+
+#Session state entry holding the memoized results of the session
+memo_state = "Memo Cache"
+
+def _digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+
+    return digest.hexdigest()
+
+def _buffers(df):
+    # Address of every column's data: a frame rebuilt or copied from a tagged one gets new buffers, so an inherited tag is not trusted
+    return (df.shape,) + tuple(df.iloc[:, col].to_numpy().__array_interface__["data"][0] for col in range(df.shape[1]))
+
+def fingerprint(df):
+    '''
+    Content hash of a DataFrame, computed from its buffers once and then kept in df.attrs.
+    Fingerprinted frames are treated as immutable: modify a copy, not the frame itself.
+    '''
+    buffers = _buffers(df)
+    tag     = df.attrs.get("fingerprint")
+    if tag is not None and tag[1] == buffers:
+        return tag[0]
+
+    fp = _digest(tuple(df.columns), tuple(map(str, df.dtypes)), pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    df.attrs["fingerprint"] = (fp, buffers)
+
+    return fp
+
+def tag_lineage(df, *lineage):
+    '''
+    Fingerprint a derived DataFrame by how it was made (e.g. its source and parameters) instead of by hashing its contents
+    '''
+    df.attrs["fingerprint"] = (_digest(*lineage), _buffers(df))
+
+    return df
+
+def cache_key(obj):
+    '''
+    Cheap hashable key for a function argument
+    '''
+    if isinstance(obj, pd.DataFrame):
+        return ("DataFrame", fingerprint(obj))
+    if isinstance(obj, pd.Series):
+        return ("Series", obj.name, str(obj.dtype), _digest(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes()))
+    if isinstance(obj, np.ndarray):
+        return ("ndarray", str(obj.dtype), obj.shape, _digest(np.ascontiguousarray(obj).tobytes()))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__,) + tuple(cache_key(item) for item in obj)
+    if isinstance(obj, dict):
+        return ("dict",) + tuple((key, cache_key(value)) for key, value in sorted(obj.items(), key=lambda item: repr(item[0])))
+    if hasattr(obj, "getvalue") and hasattr(obj, "name"):
+        # Uploaded files are identified by their upload, not their bytes
+        return ("file", obj.name, getattr(obj, "size", None), getattr(obj, "file_id", None))
+    try:
+        hash(obj)
+    except TypeError:
+        return repr(obj)
+
+    return obj
+
+def memoize(func):
+    '''
+    Cache the results of func on the cache keys of its arguments, least recently used first out after memo_size results.
+    Results are kept in the session's state, so frames and figures are released with the session that made them.
+    Results are returned as is, without copying, and must not be mutated.
+    Arguments are keyed with cache_key: pass fingerprinted frames and column names rather than arrays, which are hashed in full on every call.
+    '''
+    name = func.__module__ + "." + func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        results = st.session_state.setdefault(memo_state, dict()).setdefault(name, OrderedDict())
+        key     = (cache_key(args), cache_key(kwargs))
+        if key in results:
+            results.move_to_end(key)
+            return results[key]
+
+        result          = func(*args, **kwargs)
+        results[key]    = result
+        while len(results) > memo_size:
+            results.popitem(last=False)
+
+        return result
+
+    return wrapper
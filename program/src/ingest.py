@@ -0,0 +1,151 @@
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+import pandas as pd
+from src.cache import file_digest, cache_load, cache_store
+
+chunk_rows = 200000
+
+def detect_format(f):
+    '''
+    Identify a file as Excel or CSV from its leading bytes rather than its extension
+    '''
+    f.seek(0)
+    magic = f.read(8)
+    f.seek(0)
+
+    #xlsx files are zip archives, xls files are OLE2 compound documents
+    if magic.startswith(b"PK\x03\x04") or magic.startswith(b"\xd0\xcf\x11\xe0"):
+        return "excel"
+
+    return "csv"
+
+def read_header(f):
+    '''
+    Read only the column names of an uploaded file
+    '''
+    if detect_format(f) == "csv":
+        columns = list(pd.read_csv(f, nrows=0).columns)
+    else:
+        columns = list(pd.read_excel(f, nrows=0).columns)
+    f.seek(0)
+
+    return columns
+
+def read_preview(f, nrows):
+    if detect_format(f) == "csv":
+        df = pd.read_csv(f, nrows=nrows)
+    else:
+        df = pd.read_excel(f, nrows=nrows)
+    f.seek(0)
+
+    return df
+
+def read_columns(f, usecols=None):
+    '''
+    Parse an uploaded file keeping only the columns in usecols (all if None).
+    CSV files are streamed in chunks of chunk_rows so only the projected columns are ever held in memory.
+    '''
+    if usecols is not None:
+        header  = read_header(f)
+        usecols = [col for col in usecols if col in header]
+
+    if detect_format(f) == "csv":
+        df = pd.concat(pd.read_csv(f, usecols=usecols, chunksize=chunk_rows), ignore_index=True)
+    else:
+        df = pd.read_excel(f, usecols=usecols)
+    f.seek(0)
+
+    return df
+
+def read_cached(f, usecols=None, digest=None, parse=True):
+    '''
+    read_columns backed by the on-disk cache, keyed by a hash of the file bytes.
+    Only the columns missing from the cache are parsed, and are then added to it.
+    With parse False nothing is parsed, and None is returned unless every requested column is cached.
+    '''
+    if digest is None:
+        digest = file_digest(f)
+    header, columns = cache_load(digest, usecols)
+    if header is None and not parse:
+        return None
+    if header is None:
+        header = read_header(f)
+
+    if usecols is None:
+        usecols = header
+    usecols = [col for col in usecols if col in header]
+
+    missing = [col for col in usecols if col not in columns]
+    if missing and not parse:
+        return None
+    if missing:
+        parsed = read_columns(f, missing)
+        try:
+            cache_store(digest, parsed, header)
+        except OSError:
+            pass
+        columns.update(parsed.items())
+
+    return pd.DataFrame({col: columns[col] for col in usecols}, columns=usecols)
+
+def _read_bytes(data, digest, usecols):
+    return read_cached(io.BytesIO(data), usecols, digest)
+
+#One pool of parser processes is kept for the life of the server, started on the first load that needs it
+_pool       = None
+_pool_lock  = threading.Lock()
+
+@contextmanager
+def _hidden_main():
+    # Streamlit executes the app script as __main__, which spawned workers would otherwise run again on start up.
+    # Hiding it swaps sys.modules["__main__"] for the whole process, so anything another session's script thread
+    # does with __main__ meanwhile (e.g. pickling) sees the empty module. Workers are only started under _pool_lock,
+    # and the swap is kept as short as starting them.
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+def _parse_in_pool(jobs):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+        #Workers are spawned when jobs are submitted
+        with _hidden_main():
+            futures = [_pool.submit(_read_bytes, *job) for job in jobs]
+
+    try:
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        with _pool_lock:
+            _pool = None
+        raise
+
+def read_files(files, usecols=None):
+    '''
+    Read each file from the on-disk cache where every requested column is cached, and parse the others in a pool of worker processes,
+    merging the results once at the end. A single file to parse is parsed in process to avoid sending it to a worker.
+    '''
+    digests = [file_digest(f) for f in files]
+    frames  = [read_cached(f, usecols, digest, parse=False) for f, digest in zip(files, digests)]
+    misses  = [i for i, frame in enumerate(frames) if frame is None]
+
+    if len(misses) == 1:
+        frames[misses[0]] = read_cached(files[misses[0]], usecols, digests[misses[0]])
+    elif misses:
+        #Only the files to parse are copied to the workers
+        for i, frame in zip(misses, _parse_in_pool([(files[i].getvalue(), digests[i], usecols) for i in misses])):
+            frames[i] = frame
+
+    return pd.concat(frames, ignore_index=True)
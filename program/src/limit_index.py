@@ -0,0 +1,61 @@
+import numpy as np
+
+class LimitIndex:
+    '''
+    Absolute Nm and % errors of a set of points kept sorted, so pass/fail counts for any pair of limits
+    are answered with searchsorted instead of rescanning the data.
+    A point passes when both errors are within their limits and fails when both are outside, as in the pie chart.
+    '''
+    def __init__(self, err_nm, err_pc):
+        err_nm  = np.abs(np.asarray(err_nm, dtype=float))
+        err_pc  = np.abs(np.asarray(err_pc, dtype=float))
+
+        #Points with a NaN error can neither pass nor fail
+        self.rows       = np.flatnonzero(~np.isnan(err_nm) & ~np.isnan(err_pc))
+        self.n          = len(self.rows)
+
+        self.nm_order   = self.rows[np.argsort(err_nm[self.rows], kind="stable")]
+        self.pc_order   = self.rows[np.argsort(err_pc[self.rows], kind="stable")]
+        self.nm_sorted  = err_nm[self.nm_order]
+        self.pc_sorted  = err_pc[self.pc_order]
+
+        #Merge sort tree: level l holds the % errors in Nm order with every block of 2**l points sorted
+        size            = 1 << max(self.n - 1, 0).bit_length()
+        level           = np.full(size, np.inf)
+        level[:self.n]  = err_pc[self.nm_order]
+        self.levels     = [level]
+        while len(self.levels[-1]) > (1 << (len(self.levels) - 1)):
+            block = 1 << len(self.levels)
+            self.levels.append(np.sort(self.levels[-1].reshape(-1, block), axis=1).reshape(-1))
+
+    def _both_within(self, k, limit_pc):
+        # Number of the k smallest Nm errors whose % error is within limit_pc, O(log^2 n)
+        count   = 0
+        start   = 0
+        for l in range(len(self.levels) - 1, -1, -1):
+            block = 1 << l
+            if k - start >= block:
+                count += np.searchsorted(self.levels[l][start : start + block], limit_pc, side="right")
+                start += block
+
+        return int(count)
+
+    def counts(self, limit_nm, limit_pc):
+        '''
+        Number of passing and failing points for a pair of limits
+        '''
+        within_nm   = np.searchsorted(self.nm_sorted, limit_nm, side="right")
+        within_pc   = np.searchsorted(self.pc_sorted, limit_pc, side="right")
+        passed      = self._both_within(within_nm, limit_pc)
+        failed      = self.n - within_nm - within_pc + passed
+
+        return passed, failed
+
+    def sensitivity(self, limit_nm, limit_pc, scales):
+        '''
+        Pass rate [%] with both limits scaled by each of scales
+        '''
+        if self.n == 0:
+            return np.full(len(scales), np.nan)
+
+        return np.array([self.counts(scale * limit_nm, scale * limit_pc)[0] for scale in scales]) / self.n * 100
@@ -0,0 +1,43 @@
+import pandas as pd
+import streamlit as st
+from src.fingerprint import tag_lineage
+
+def stage(name, key, compute, status=None):
+    '''
+    Memoize one pipeline stage for the session: compute() only runs when key differs from the key of the stage's last result.
+    Each stage key is built from its upstream stage's key plus its own parameters, so a change only reruns the stages downstream of it.
+    Results are reused across reruns and must not be mutated by later stages.
+    '''
+    cache       = st.session_state.setdefault("Pipeline Cache", dict())
+    counters    = st.session_state.setdefault("Pipeline Counters", dict())
+    hits, misses, _ = counters.get(name, (0, 0, None))
+
+    if name in cache and cache[name][0] == key:
+        counters[name] = (hits + 1, misses, "Hit")
+    else:
+        result = compute()
+        #Tag the result (or each frame of a tuple of results) with its lineage so later memoized calls on it do not hash its contents
+        if isinstance(result, pd.DataFrame):
+            tag_lineage(result, name, key)
+        elif isinstance(result, tuple):
+            for index, item in enumerate(result):
+                if isinstance(item, pd.DataFrame):
+                    tag_lineage(item, name, key, index)
+        cache[name]    = (key, result)
+        counters[name] = (hits, misses + 1, "Miss")
+
+    if status is not None:
+        status.dataframe(stage_summary())
+
+    return cache[name][1]
+
+def stage_summary():
+    '''
+    Hit and miss counts of every stage this session, with the outcome of its latest run, indexed by stage
+    '''
+    counters = st.session_state.get("Pipeline Counters", dict())
+
+    return pd.DataFrame(
+                        [(name, hits, misses, last) for name, (hits, misses, last) in counters.items()],
+                        columns = ["Stage", "Hits", "Misses", "Last Run"]
+                        ).set_index("Stage")
@@ -1,6 +1,10 @@
+import numpy as np
 import plotly.graph_objects as go
 import streamlit as st
 from src.colors import qualitive_color_dict
+from src.downsample import lttb, pixel_dedupe, density_grid
+from src.fingerprint import memoize
+from src.utils import z_col_or_grid
 
 def demanded_plot(data, t_demanded, speed_round):
 
@@ -20,38 +24,50 @@ def demanded_plot(data, t_demanded, speed_round):
                                 )
     return test_plot
 
-def transient_removal_plot(transient_sample, Step_index, Stop_index, df, test_dict, t_demanded, t_estimated, t_measured):
+def transient_removal_plot(transient_sample, segments, df, test_dict, t_demanded, t_estimated, t_measured, timestamp=None):
+    start = segments.start[test_dict["Sample"]]
+    stop  = min(segments.stop[test_dict["Sample"]], len(df) - 1)
+
+    if timestamp is None:
+        x, x_start, x_stop, x_title = transient_sample.index.values, df.index[start], df.index[stop], 'Sample [N]'
+    else:
+        x, x_start, x_stop, x_title = transient_sample[timestamp], df[timestamp].iat[start], df[timestamp].iat[stop], timestamp
+
+    #Downsample each trace for display, keeping its edges and peaks
+    x       = np.asarray(x)
+    visible = {signal: lttb(x, transient_sample[signal]) for signal in [t_demanded, t_estimated, t_measured]}
+
     transient_plot = go.Figure()
 
     transient_plot.add_trace(go.Scatter (  
-                                        x       = transient_sample.index.values, 
-                                        y       = transient_sample[t_demanded], 
+                                        x       = x[visible[t_demanded]], 
+                                        y       = transient_sample[t_demanded].iloc[visible[t_demanded]], 
                                         name    = t_demanded,
                                         hovertemplate = '%{y:.2f} Nm'
                             )           )
 
     transient_plot.add_trace(go.Scatter (  
-                                        x       = transient_sample.index.values, 
-                                        y       = transient_sample[t_estimated],
+                                        x       = x[visible[t_estimated]], 
+                                        y       = transient_sample[t_estimated].iloc[visible[t_estimated]],
                                         name    = t_estimated,
                                         hovertemplate = '%{y:.2f} Nm'
                             )           )
 
     transient_plot.add_trace(go.Scatter (  
-                                        x       = transient_sample.index.values, 
-                                        y       = transient_sample[t_measured], 
+                                        x       = x[visible[t_measured]], 
+                                        y       = transient_sample[t_measured].iloc[visible[t_measured]], 
                                         name    = t_measured,
                                         hovertemplate = '%{y:.2f} Nm'
                             )           )
 
     transient_plot.update_layout    (   
                                     title       = 'Transient Removal Example',
-                                    xaxis_title = 'Sample [N]',
+                                    xaxis_title = x_title,
                                     yaxis_title = 'Torque [Nm]'
                                     )
     transient_plot.add_annotation   (
-                                    x           = Step_index[test_dict["Sample"]],
-                                    y           = df[t_demanded][Step_index[test_dict["Sample"]]],
+                                    x           = x_start,
+                                    y           = df[t_demanded].iat[start],
                                     xref        = "x",
                                     yref        = "y",
                                     text        = "Start of removal",
@@ -73,8 +89,8 @@ def transient_removal_plot(transient_sample, Step_index, Stop_index, df, test_di
                                     )
 
     transient_plot.add_annotation   (
-                                    x           = Stop_index[test_dict["Sample"]],
-                                    y           = df[t_demanded][Stop_index[test_dict["Sample"]]],
+                                    x           = x_stop,
+                                    y           = df[t_demanded].iat[stop],
                                     xref        = "x",
                                     yref        = "y",
                                     text        = "End of removal",
@@ -101,9 +117,41 @@ def transient_removal_plot(transient_sample, Step_index, Stop_index, df, test_di
                                     )
     return transient_plot
 
-@st.cache
-def plot_3D(df, x_string, y_string, z_string, x, y, z, chart_type, color_palette, overlay, overlay_alpha, overlay_color):
+def dwell_sweep_plot(sweep, suggested, dwell_unit):
+    sweep_plot = go.Figure()
+
+    sweep_plot.add_trace(go.Scatter (  
+                                    x       = sweep["Dwell Period"], 
+                                    y       = sweep["Error Spread [Nm]"], 
+                                    name    = "Error Spread [Nm]",
+                                    hovertemplate = '%{y:.3f} Nm'
+                        )           )
+
+    sweep_plot.add_trace(go.Scatter (  
+                                    x       = sweep["Dwell Period"], 
+                                    y       = sweep["Samples Removed [%]"], 
+                                    name    = "Samples Removed [%]",
+                                    yaxis   = "y2",
+                                    hovertemplate = '%{y:.1f} %'
+                        )           )
+
+    sweep_plot.update_layout    (   
+                                title       = 'Dwell Period Sweep',
+                                xaxis_title = 'Dwell Period [' + dwell_unit + ']',
+                                yaxis       = dict(title = 'Error Spread [Nm]'),
+                                yaxis2      = dict(title = 'Samples Removed [%]', overlaying = 'y', side = 'right')
+                                )
+
+    if suggested is not None:
+        sweep_plot.add_vline(x = suggested, line_dash = "dot", annotation_text = "Suggested: " + str(suggested))
+
+    return sweep_plot
+
+@memoize
+def plot_3D(df, x_string, y_string, z_string, grid, chart_type, color_palette, overlay, overlay_alpha, overlay_color, overlay_density=None):
+    # grid holds the z_col_or_grid settings: the columns gridded on, fill, method, resolution and zoom ranges
     with st.spinner("Generating 3D Plot"):
+        x, y, z = z_col_or_grid(chart_type, grid["fill"], grid["method"], grid["grid_res"], df, grid["x"], grid["y"], z_string, grid["x_range"], grid["y_range"])
         label_dict = dict()
         trace_dict = dict()
 
@@ -246,12 +294,26 @@ def plot_3D(df, x_string, y_string, z_string, x, y, z, chart_type, color_palette
         plot_3D.update_layout(label_dict)              
         plot_3D.update_traces(trace_dict)
 
-        if (overlay == True) and (chart_type != "3D Scatter" or "Surface") :
-            st.write(x)
-            st.write(y)
+        if (overlay == True) and (chart_type not in ("3D Scatter", "Surface")) :
+            if overlay_density is not None:
+                density_x, density_y, density = overlay_density
+                plot_3D.add_trace   (go.Heatmap (
+                                x               = density_x,
+                                y               = density_y,
+                                z               = density,
+                                name            = "Sample Density",
+                                opacity         = overlay_alpha,
+                                colorscale      = [[0, "rgba(0,0,0,0)"], [1, overlay_color]],
+                                showscale       = False,
+                                hovertemplate   = x_string + ': %{x:.2f}<br>' + y_string + ': %{y:.2f}<br>Samples: %{z}'
+                                ),
+                    )
+                return plot_3D
+
+            visible = pixel_dedupe(df[x_string], df[y_string])
             plot_3D.add_trace	(go.Scattergl (  
-                            x       		= df[x_string],
-                            y       		= df[y_string],
+                            x       		= df[x_string].iloc[visible],
+                            y       		= df[y_string].iloc[visible],
                             name 			= "X: "  + x_string + "</br>Y: "  + y_string,
                             mode            = 'markers',
                             opacity         = overlay_alpha,
@@ -264,10 +326,9 @@ def plot_3D(df, x_string, y_string, z_string, x, y, z, chart_type, color_palette
         
         return plot_3D
 
-def plot_pie(df, err_nm, err_pc, limit_nm, limit_pc):
+def plot_pie(limit_index, limit_nm, limit_pc):
 
-    Pass = len( df[(abs(err_nm) <= limit_nm) & (abs(err_pc) <= limit_pc)] )
-    Fail = len( df[(abs(err_nm) > limit_nm) & (abs(err_pc) > limit_pc)] )
+    Pass, Fail = limit_index.counts(limit_nm, limit_pc)
 
 
     plot = go.Figure   (
@@ -280,97 +341,48 @@ def plot_pie(df, err_nm, err_pc, limit_nm, limit_pc):
 
     return plot
 
-def plot_bowtie(df, t_in, t_in_error_nm, t_in_error_pc, t_measured,speed_rpm_round, limit_nm, limit_pc):
-
-    qual_colors = qualitive_color_dict()
-
-    plot_pc = 0
-    plot_pc = df[ (abs(df[t_in]) >= limit_nm/(limit_pc/100)) ]
-
-    plot_nm = 0
-    plot_nm = df[ (abs(df[t_in]) < limit_nm/(limit_pc/100)) ]
-
+def plot_limit_sensitivity(curves, scales):
+    '''
+    Pass rate against limit, one curve per torque with its Nm and % limits scaled together
+    '''
     plot = go.Figure()
 
-    plot.add_trace(go.Scatter   (  
-                                            x               = plot_pc[t_in], 
-                                            y               = plot_pc[t_in_error_pc],
-                                            name            = t_in_error_pc,
-                                            customdata      = plot_pc[t_measured],
-                                            text            = plot_pc[speed_rpm_round],
-                                            hovertemplate   = 'Torque Measured: %{customdata:.2f} Nm' + 
-                                                              '<br>Torque Demanded: %{x:.2f} Nm' +
-                                                              '<br>Torque Demanded Error: %{y:.2f} %' +
-                                                              '<br>Speed: %{text:.2f} rpm',
-                                            mode            = "markers",
-                                            marker_symbol   = 'circle-dot',
-                                            marker          = dict  (
-                                                                    color = qual_colors["Plotly"][1],
-                                                                    opacity=0.5,
-                                                                    line=dict(
-                                                                                color='black',
-                                                                                width=1
-                                                                                )
-                                                                    )
-                                )           )
-
+    for name, (pass_rate, limit_nm, limit_pc) in curves.items():
+        plot.add_trace(go.Scatter   (
+                                    x               = scales * limit_nm,
+                                    y               = pass_rate,
+                                    name            = name,
+                                    customdata      = scales * limit_pc,
+                                    hovertemplate   = 'Limit: %{x:.2f} Nm / %{customdata:.2f} %' +
+                                                      '<br>Pass Rate: %{y:.1f} %',
+                                    mode            = "lines"
+                                    )
+                        )
+        plot.add_vline(x = limit_nm, line_dash = "dash")
 
-    plot.add_trace(go.Scatter   (  
-                                            x               = plot_nm[t_in], 
-                                            y               = plot_nm[t_in_error_nm],
-                                            name            = "Torque Demanded Error (Nm)",
-                                            customdata      = plot_nm[t_measured],
-                                            text            = plot_nm[speed_rpm_round],
-                                            hovertemplate   = 'Torque Measured: %{customdata:.2f} Nm' + 
-                                                              '<br>Torque Demanded: %{x:.2f} Nm' +
-                                                              '<br>Torque Demanded Error: %{y:.2f} Nm' +
-                                                              '<br>Speed: %{text:.2f} rpm',
-                                            mode            = "markers",
-                                            marker_symbol   = 'circle-dot',
-                                            marker          = dict  (
-                                                                    color = qual_colors["Plotly"][0],
-                                                                    opacity=0.5,
-                                                                    line=dict(
-                                                                                color='black',
-                                                                                width=1
-                                                                                )
-                                                                    )
-                                )           )
+    plot.update_layout  (
+                        title       = 'Limit Sensitivity',
+                        xaxis_title = 'Limit [Nm] (% limit scaled alike)',
+                        yaxis_title = 'Pass Rate [%]'
+                        )
 
-    plot.add_shape(
-                                    type = "line",
-                                    x0   = 0, 
-                                    y0   = limit_nm, 
-                                    x1   = limit_nm/(limit_pc/100), 
-                                    y1   = limit_nm,
-                                    line = dict
-                                             (
-                                                color=qual_colors["Plotly"][0],
-                                                width=2,
-                                                dash="dot",
-                                            )
-                                    )
+    return plot
 
-    plot.add_shape(
-                                    type = "line",
-                                    x0   = 0, 
-                                    y0   = -1* limit_nm, 
-                                    x1   = limit_nm/(limit_pc/100), 
-                                    y1   = -1* limit_nm,
-                                    line = dict
-                                             (
-                                                color=qual_colors["Plotly"][0],
-                                                width=2,
-                                                dash="dot",
-                                            )
-                                    )
+def bowtie_limit_lines(plot, pc_torque, limit_nm, limit_pc):
+    '''
+    Draw the bowtie limits: +/- limit_nm up to the Nm/% boundary torque, then +/- limit_pc of torque beyond it (from the % region torques pc_torque)
+    '''
+    qual_colors = qualitive_color_dict()
+    boundary    = limit_nm/(limit_pc/100)
 
-    plot.add_shape(
+    for side in [1, -1]:
+        for sign in [1, -1]:
+            plot.add_shape(
                                     type = "line",
                                     x0   = 0, 
-                                    y0   = limit_nm, 
-                                    x1   = -limit_nm/(limit_pc/100), 
-                                    y1   = limit_nm,
+                                    y0   = sign * limit_nm, 
+                                    x1   = side * boundary, 
+                                    y1   = sign * limit_nm,
                                     line = dict
                                              (
                                                 color=qual_colors["Plotly"][0],
@@ -379,26 +391,17 @@ def plot_bowtie(df, t_in, t_in_error_nm, t_in_error_pc, t_measured,speed_rpm_rou
                                             )
                                     )
 
-    plot.add_shape(
-                                    type = "line",
-                                    x0   = 0, 
-                                    y0   = -1* limit_nm, 
-                                    x1   = -limit_nm/(limit_pc/100), 
-                                    y1   = -1* limit_nm,
-                                    line = dict
-                                             (
-                                                color=qual_colors["Plotly"][0],
-                                                width=2,
-                                                dash="dot",
-                                            )
-                                    )
+    if len(pc_torque) == 0:
+        return
 
-    plot.add_shape(
+    for side in [1, -1]:
+        for sign in [1, -1]:
+            plot.add_shape(
                                 type = "line",
-                                x0   = limit_nm/(limit_pc/100), 
-                                y0   = min(abs(plot_pc[t_in]))*limit_pc/100, 
-                                x1   = max(abs(plot_pc[t_in])), 
-                                y1   = max(abs(plot_pc[t_in]))*limit_pc/100,
+                                x0   = side * boundary, 
+                                y0   = sign * side * min(abs(pc_torque))*limit_pc/100, 
+                                x1   = side * max(abs(pc_torque)), 
+                                y1   = sign * side * max(abs(pc_torque))*limit_pc/100,
                                 line = dict
                                             (
                                             color=qual_colors["Plotly"][1],
@@ -407,47 +410,80 @@ def plot_bowtie(df, t_in, t_in_error_nm, t_in_error_pc, t_measured,speed_rpm_rou
                                         )
                                 )
 
-    plot.add_shape(
-                                type = "line",
-                                x0   = limit_nm/(limit_pc/100), 
-                                y0   = min(abs(plot_pc[t_in]))*-limit_pc/100, 
-                                x1   = max(abs(plot_pc[t_in])), 
-                                y1   = max(abs(plot_pc[t_in]))*-limit_pc/100,
-                                line = dict
-                                            (
-                                            color=qual_colors["Plotly"][1],
-                                            width=2,
-                                            dash="dot",
-                                        )
-                                )
+def plot_bowtie(df, t_in, t_in_error_nm, t_in_error_pc, t_measured,speed_rpm_round, limit_nm, limit_pc, density=False):
 
-    plot.add_shape(
-                                type = "line",
-                                x0   = -1*limit_nm/(limit_pc/100), 
-                                y0   = -1*min(abs(plot_pc[t_in]))*limit_pc/100, 
-                                x1   = -1*max(abs(plot_pc[t_in])), 
-                                y1   = -1*max(abs(plot_pc[t_in]))*limit_pc/100,
-                                line = dict
-                                            (
-                                            color=qual_colors["Plotly"][1],
-                                            width=2,
-                                            dash="dot",
-                                        )
-                                )
+    qual_colors = qualitive_color_dict()
 
-    plot.add_shape(
-                            type = "line",
-                            x0   = -1*limit_nm/(limit_pc/100), 
-                            y0   = min(abs(plot_pc[t_in]))*limit_pc/100, 
-                            x1   = -1*max(abs(plot_pc[t_in])), 
-                            y1   = max(abs(plot_pc[t_in]))*limit_pc/100,
-                            line = dict
-                                        (
-                                        color=qual_colors["Plotly"][1],
-                                        width=2,
-                                        dash="dot",
-                                    )
-                            )
+    plot_pc = 0
+    plot_pc = df[ (abs(df[t_in]) >= limit_nm/(limit_pc/100)) ]
+
+    plot_nm = 0
+    plot_nm = df[ (abs(df[t_in]) < limit_nm/(limit_pc/100)) ]
+
+    plot = go.Figure()
+
+    if density == True:
+        # Unaveraged data: one heatmap of sample counts, with % errors above the boundary torque and Nm errors below
+        torque                          = df[t_in].to_numpy(dtype=float)
+        error                           = np.where(abs(torque) >= limit_nm/(limit_pc/100), df[t_in_error_pc].to_numpy(dtype=float), df[t_in_error_nm].to_numpy(dtype=float))
+        density_x, density_y, density   = density_grid(torque, error)
+
+        plot.add_trace(go.Heatmap   (
+                                    x               = density_x,
+                                    y               = density_y,
+                                    z               = density,
+                                    name            = "Sample Density",
+                                    colorscale      = "Viridis",
+                                    colorbar        = dict(title = "Samples"),
+                                    hovertemplate   = str(t_in) + ': %{x:.2f} Nm<br>Torque Error: %{y:.2f}<br>Samples: %{z}'
+                        )           )
+    else:
+        plot.add_trace(go.Scatter   (  
+                                                x               = plot_pc[t_in], 
+                                                y               = plot_pc[t_in_error_pc],
+                                                name            = t_in_error_pc,
+                                                customdata      = plot_pc[t_measured],
+                                                text            = plot_pc[speed_rpm_round],
+                                                hovertemplate   = 'Torque Measured: %{customdata:.2f} Nm' + 
+                                                                  '<br>Torque Demanded: %{x:.2f} Nm' +
+                                                                  '<br>Torque Demanded Error: %{y:.2f} %' +
+                                                                  '<br>Speed: %{text:.2f} rpm',
+                                                mode            = "markers",
+                                                marker_symbol   = 'circle-dot',
+                                                marker          = dict  (
+                                                                        color = qual_colors["Plotly"][1],
+                                                                        opacity=0.5,
+                                                                        line=dict(
+                                                                                    color='black',
+                                                                                    width=1
+                                                                                    )
+                                                                        )
+                                    )           )
+
+
+        plot.add_trace(go.Scatter   (  
+                                                x               = plot_nm[t_in], 
+                                                y               = plot_nm[t_in_error_nm],
+                                                name            = "Torque Demanded Error (Nm)",
+                                                customdata      = plot_nm[t_measured],
+                                                text            = plot_nm[speed_rpm_round],
+                                                hovertemplate   = 'Torque Measured: %{customdata:.2f} Nm' + 
+                                                                  '<br>Torque Demanded: %{x:.2f} Nm' +
+                                                                  '<br>Torque Demanded Error: %{y:.2f} Nm' +
+                                                                  '<br>Speed: %{text:.2f} rpm',
+                                                mode            = "markers",
+                                                marker_symbol   = 'circle-dot',
+                                                marker          = dict  (
+                                                                        color = qual_colors["Plotly"][0],
+                                                                        opacity=0.5,
+                                                                        line=dict(
+                                                                                    color='black',
+                                                                                    width=1
+                                                                                    )
+                                                                        )
+                                    )           )
+
+    bowtie_limit_lines(plot, plot_pc[t_in], limit_nm, limit_pc)
 
     plot.update_layout  (   
                                     title       =str(t_in) + ' & [%] Bowtie',
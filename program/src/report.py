@@ -0,0 +1,661 @@
+import atexit
+import base64
+import glob
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from src.fingerprint import cache_key
+
+#Session state entries that are not report inputs
+internal_state = ["Pipeline Cache", "Pipeline Counters", "Memo Cache", "Report Job"]
+
+#Rows shown per page of an appendix table
+page_rows = 50
+
+#Temporary report files are named with this prefix, any older than stale_report_age [s] are left over from an earlier run
+report_prefix       = "torque_accuracy_report_"
+stale_report_age    = 24 * 60 * 60
+
+#Report files written by this process, deleted when it exits
+_report_files = set()
+
+#Renders the appendix tables: columns are decompressed in the browser and only the rows of the current page are made into DOM
+data_table_js = '''
+async function reportColumn(column) {
+    const bytes     = Uint8Array.from(atob(column.data), c => c.charCodeAt(0));
+    const buffer    = await new Response(new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"))).arrayBuffer();
+    return column.numeric ? new Float64Array(buffer) : JSON.parse(new TextDecoder().decode(buffer));
+}
+
+function reportFormat(value) {
+    return typeof value === "number" && !Number.isInteger(value) ? String(parseFloat(value.toPrecision(6))) : String(value);
+}
+
+async function reportTable(id, columns, pageRows) {
+    const container = document.getElementById(id);
+    const body      = container.querySelector("tbody");
+
+    container.querySelector("thead tr").replaceChildren(...columns.map(column => {
+        const th = document.createElement("th");
+        th.textContent = column.name;
+        return th;
+    }));
+
+    //Browsers without DecompressionStream, or a damaged column, get a notice in place of the rows
+    let values;
+    try {
+        values = await Promise.all(columns.map(reportColumn));
+    } catch (error) {
+        const tr = document.createElement("tr");
+        const td = document.createElement("td");
+        td.colSpan      = Math.max(1, columns.length);
+        td.textContent  = "This table could not be shown: it needs a browser with DecompressionStream support (" + error + ").";
+        tr.appendChild(td);
+        body.replaceChildren(tr);
+        return;
+    }
+    const rows      = values.length ? values[0].length : 0;
+    const pages     = Math.max(1, Math.ceil(rows / pageRows));
+
+    const page  = container.querySelector("input");
+    page.max    = pages;
+    container.querySelector(".report-pages").textContent = "of " + pages + " (" + rows + " rows)";
+
+    function show(number) {
+        number      = Math.min(Math.max(1, number || 1), pages);
+        page.value  = number;
+        const start = (number - 1) * pageRows;
+        const trs   = [];
+        for (let row = start; row < Math.min(start + pageRows, rows); row++) {
+            const tr = document.createElement("tr");
+            for (const column of values) {
+                const td = document.createElement("td");
+                td.textContent = reportFormat(column[row]);
+                tr.appendChild(td);
+            }
+            trs.push(tr);
+        }
+        body.replaceChildren(...trs);
+    }
+
+    container.querySelector(".report-previous").onclick = () => show(Number(page.value) - 1);
+    container.querySelector(".report-next").onclick     = () => show(Number(page.value) + 1);
+    page.onchange                                       = () => show(Number(page.value));
+    show(1);
+}
+'''
+
+def report_key(state, *inputs):
+    '''
+    Key of everything the report depends on: the keyed widget values held in session state plus any other inputs given
+    '''
+    return cache_key(({key: value for key, value in state.items() if key not in internal_state},) + inputs)
+
+def _figure_html(fig, width = "1200px", height = "720px"):
+    # Only the figure's div and its JSON, plotly.js is included once in the head of the report
+    if fig is None:
+        return ""
+
+    return fig.to_html(full_html = False, include_plotlyjs = False, default_width = width, default_height = height)
+
+def _table_html(df):
+    return df.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0")
+
+def _encode_column(name, values):
+    # Numeric columns as gzipped little endian float64 arrays, anything else as gzipped JSON strings, both base64 encoded
+    numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+    if numeric:
+        data = np.asarray(values, dtype="<f8").tobytes()
+    else:
+        data = json.dumps(values.astype(str).tolist()).encode()
+
+    return {"name": str(name), "numeric": numeric, "data": base64.b64encode(gzip.compress(data, 6)).decode()}
+
+def _data_table_html(df, table_id, classes):
+    '''
+    Table of a DataFrame, index included, embedded as compressed columns and paged in the browser by reportTable,
+    so a long dataset costs a few bytes per value rather than a row of HTML per sample
+    '''
+    columns = [_encode_column(df.index.name or "", df.index.to_series())] + [_encode_column(name, df[name]) for name in df.columns]
+
+    return '''
+    <div id="''' + table_id + '''">
+        <div class="d-flex align-items-center gap-2 mb-2">
+            <button type="button" class="btn btn-sm btn-outline-secondary report-previous">Previous</button>
+            <span>Page</span>
+            <input type="number" min="1" value="1" class="form-control form-control-sm" style="width: 100px">
+            <span class="report-pages"></span>
+            <button type="button" class="btn btn-sm btn-outline-secondary report-next">Next</button>
+        </div>
+        <table class="''' + classes + '''"><thead><tr></tr></thead><tbody></tbody></table>
+    </div>
+    <script type="text/javascript">reportTable("''' + table_id + '''", ''' + json.dumps(columns).replace("</", "<\\/") + ''', ''' + str(page_rows) + ''');</script>
+    '''
+
+def _dataframe_html(df):
+    if df is None:
+        return ""
+
+    return '''
+    <br><h4>Full Dataset Table</h4>
+    <br><p>The below table contains all the data uploaded.</p>
+    <br>'''+ _data_table_html(df, "full-dataset-table", "table table-sm") +'''
+    '''
+
+def write_report(inputs, out, progress = None, cancel = None):
+    '''
+    Write the HTML report to the text stream out, section by section, from the figures, tables and text in inputs
+    and a snapshot of session state in inputs["state"]. Each figure or table is rendered just before it is written.
+    progress(fraction, text) is called before each one is rendered.
+    Stops between sections once the threading.Event cancel is set. Returns whether the report was written in full.
+    '''
+    state   = inputs["state"]
+    renders = {
+                "plotly_js"                     : get_plotlyjs,
+                "transient_removal_sample_plot" : lambda: _figure_html(inputs["transient_removal_sample_plot"]),
+                "t_demanded_error_table_nm"     : lambda: _table_html(inputs["t_demanded_error_table_nm"]),
+                "t_demanded_error_table_pc"     : lambda: _table_html(inputs["t_demanded_error_table_pc"]),
+                "dem_pie"                       : lambda: _figure_html(inputs["dem_pie"], "500px", "500px"),
+                "t_estimated_error_table_nm"    : lambda: _table_html(inputs["t_estimated_error_table_nm"]),
+                "t_estimated_error_table_pc"    : lambda: _table_html(inputs["t_estimated_error_table_pc"]),
+                "est_pie"                       : lambda: _figure_html(inputs["est_pie"], "500px", "500px"),
+                "dem_quadrant_table"            : lambda: _table_html(inputs["dem_quadrant_table"]),
+                "est_quadrant_table"            : lambda: _table_html(inputs["est_quadrant_table"]),
+                "dem_quadrant_violators"        : lambda: _table_html(inputs["dem_quadrant_violators"]),
+                "est_quadrant_violators"        : lambda: _table_html(inputs["est_quadrant_violators"]),
+                "td_bowtie"                     : lambda: _figure_html(inputs["td_bowtie"]),
+                "te_bowtie"                     : lambda: _figure_html(inputs["te_bowtie"]),
+                "t_d_error_nm_plot"             : lambda: _figure_html(inputs["t_d_error_nm_plot"]),
+                "t_d_error_pc_plot"             : lambda: _figure_html(inputs["t_d_error_pc_plot"]),
+                "selected_data"                 : lambda: _data_table_html(inputs["selected_data"], "selected-data-table", "table table-striped table-sm"),
+                "dataframe"                     : lambda: _dataframe_html(inputs["dataframe"]),
+                }
+
+    sections = (
+'''
+<html>
+    <head>
+        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.1/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-F3w7mX95PdgyTmZZMECAngseQB83DfGTowi0iMjiWaeVhAn4FJkqJByhZMI3AhiU" crossorigin="anonymous">
+        <style>body{ margin:100 100; background:white; }</style>
+        <script type="text/javascript">''', renders["plotly_js"], '''</script>
+        <script type="text/javascript">''', data_table_js, '''</script>
+    </head>
+    <body>
+        <div class="container h-10">
+            <div class="row h-10 justify-content-center align-items-center">
+            <img src="https://turntide.com/wp-content/themes/turntide2021/theme/static/images/logo-color.svg" style="width: 400px" />
+            <br>
+            </div>
+        </div>
+
+        <h1 class="display-1 text-center">Torque Accuracy Results</h1>
+
+        <br>
+
+        <!-- *** Section 1 *** --->
+        <h2>Report Details</h2>
+        <br>
+            <h4>Testing</h4>
+
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Test Name</th>
+                  <td>''', str(state["Test Name"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>User</th>
+                  <td>''', str(state["User"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Test Date</th>
+                  <td>''', str(state["Test Date"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Test Note</th>
+                  <td>''', str(state["Test Note"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+
+
+                <br>
+
+            <h4>Software</h4>
+
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Dyno</th>
+                  <td>''', str(state["Dyno"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Torque Speed Sensor</th>
+                  <td>''', str(state["Torque Speed Sensor"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Sensor Calibration Date</th>
+                  <td>''', str(state["Sensor Calibration Date"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+            <br>
+
+            <h4>Motor</h4>
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Software Level</th>
+                  <td>''', str(state["Software Level"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Software Location</th>
+                  <td>''', str(state["Software Location"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Software Notes</th>
+                  <td>''', str(state["Software Notes"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+            <br>
+
+            <h4>Controller</h4>
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Controller Manufacturer</th>
+                  <td>''', str(state["Controller Manufacturer"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Controller Model</th>
+                  <td>''', str(state["Controller Model"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Controller Sample</th>
+                  <td>''', str(state["Controller Sample"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Controller Notes</th>
+                  <td>''', str(state["Controller Notes"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+            <br>
+
+            <h4>Dyno</h4>
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Motor Manufacturer</th>
+                  <td>''', str(state["Motor Manufacturer"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Motor Model</th>
+                  <td>''', str(state["Motor Model"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Motor Sample</th>
+                  <td>''', str(state["Motor Sample"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Motor Notes</th>
+                  <td>''', str(state["Motor Notes"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+            <br>
+
+            <h4>Limits</h4>
+            <table class="table">
+              <tbody>
+                <tr>
+                <th scope="row", width = 300>Output [Nm]</th>
+                  <td>''', str(state["Output Limit [Nm]"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Output [%]</th>
+                  <td>''', str(state["Output Limit [%]"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Estimated [Nm]</th>
+                  <td>''', str(state["Estimated Limit [Nm]"]), '''</td>
+                </tr>
+                <th scope="row", width = 300>Estimated [%]</th>
+                  <td>''', str(state["Estimated Limit [%]"]), '''</td>
+                </tr>
+              </tbody>
+            </table>
+            <br>
+
+            <!-- *** Section 2 *** --->
+            <h2>Input Files</h2>
+                ''', inputs["input_files_table"], '''
+                <br>
+
+            <h2>Transient Removal</h2> 
+                ''', inputs["transient_removal_html"], '''
+                ''', renders["transient_removal_sample_plot"], '''
+                <br>
+
+            <h2>Unique Points</h2>
+                <p>There are ''', str(inputs["number_of_rounded_speeds"]), ''' unique speed points identified.</p>
+                ''', inputs["voltage_points_html"], '''
+                <br>
+
+        <!-- *** Section 3 *** --->
+        <h2>Torque Output Accuracy</h2>
+        <p>Minimum, Mean and Maximum errors are absoluted.</p>
+
+            <br>
+            <h4>Newton Meter Error</h4>
+            <p>Limit:&plusmn''', str(state["Output Limit [Nm]"]), '''Nm</p>
+            ''', inputs["t_d_nm_flag_html"], '''
+            
+            <table class="table">
+              <thead>
+                <tr>
+                  <th scope="col">Minimum</th>
+                  <th scope="col">Mean</th>
+                  <th scope="col">Maximum</th>
+                </tr>
+              </thead>
+              <tbody>
+                <tr>
+                  <td>''', inputs["min_error_demanded_nm_display"], '''</td>
+                  <td>''', inputs["average_error_demanded_nm_display"], '''</td>
+                  <td>''', inputs["max_error_demanded_nm_display"], '''</td>
+                </tr>
+              </tbody>
+            </table>
+
+            ''', renders["t_demanded_error_table_nm"], '''
+            <br>
+            <h4>Percentage Error</h4>
+            
+            <p>Limit:&plusmn''', str(state["Output Limit [%]"]), '''%</p>
+            ''', inputs["t_d_pc_flag_html"], '''
+            
+            <table class="table">
+              <thead>
+                <tr>
+                  <th scope="col">Minimum</th>
+                  <th scope="col">Mean</th>
+                  <th scope="col">Maximum</th>
+                </tr>
+              </thead>
+              <tbody>
+                <tr>
+                  <td>''', inputs["min_error_demanded_pc_display"], '''</td>
+                  <td>''', inputs["average_error_demanded_pc_display"], '''</td>
+                  <td>''', inputs["max_error_demanded_pc_display"], '''</td>
+                </tr>
+              </tbody>
+            </table>
+
+            ''', renders["t_demanded_error_table_pc"], '''
+            <br>
+
+            <h4> Pass : Fail </h4>
+
+            <div class="container">
+            <div class="row">
+                <div class="col align-self-start">
+                
+                </div>
+                <div class="col align-self-center">
+                ''', renders["dem_pie"], '''
+                </div>
+                <div class="col align-self-end">
+                
+                </div>
+            </div>
+            </div> 
+
+            <br>
+
+        <h2>Torque Estimated Accuracy</h2>
+
+            <br>
+            <h4>Newton Meter Error</h4>
+            <p>Limit:&plusmn''', str(state["Estimated Limit [Nm]"]), '''Nm</p>
+            ''', inputs["t_e_nm_flag_html"], '''
+            
+            <table class="table">
+              <thead>
+                <tr>
+                  <th scope="col">Minimum</th>
+                  <th scope="col">Mean</th>
+                  <th scope="col">Maximum</th>
+                </tr>
+              </thead>
+              <tbody>
+                <tr>
+                  <td>''', inputs["min_error_estimated_nm_display"], '''</td>
+                  <td>''', inputs["average_error_estimated_nm_display"], '''</td>
+                  <td>''', inputs["max_error_estimated_nm_display"], '''</td>
+                </tr>
+              </tbody>
+            </table>
+
+            ''', renders["t_estimated_error_table_nm"], '''
+
+            <br>
+            <h4>Percentage Error</h4>
+
+            <p>Limit:&plusmn''', str(state["Estimated Limit [%]"]), '''%</p>
+            ''', inputs["t_e_pc_flag_html"], '''
+            
+            <table class="table">
+              <thead>
+                <tr>
+                  <th scope="col">Minimum</th>
+                  <th scope="col">Mean</th>
+                  <th scope="col">Maximum</th>
+                </tr>
+              </thead>
+              <tbody>
+                <tr>
+                  <td>''', inputs["min_error_estimated_pc_display"], '''</td>
+                  <td>''', inputs["average_error_estimated_pc_display"], '''</td>
+                  <td>''', inputs["max_error_estimated_pc_display"], '''</td>
+                </tr>
+              </tbody>
+            </table>
+
+            ''', renders["t_estimated_error_table_pc"], '''
+            <br>
+
+            <h4> Pass : Fail </h4>
+            <div class="container">
+            <div class="row">
+                <div class="col align-self-start">
+                
+                </div>
+                <div class="col align-self-center">
+                ''', renders["est_pie"], '''
+                </div>
+                <div class="col align-self-end">
+                
+                </div>
+            </div>
+            </div> 
+
+        <h2>Accuracy per Quadrant</h2>
+        <p>Quadrants are classified from the signs of rounded speed and torque. Errors are absoluted.
+        A point passes when both its Nm and % errors are within the limits and fails when both are outside.</p>
+            <h4>Torque Output</h4>
+            ''', renders["dem_quadrant_table"], '''
+            <p>Worst failing points per quadrant</p>
+            ''', renders["dem_quadrant_violators"], '''
+            <h4>Torque Estimated</h4>
+            ''', renders["est_quadrant_table"], '''
+            <p>Worst failing points per quadrant</p>
+            ''', renders["est_quadrant_violators"], '''
+            <br>
+
+        <!-- *** Section 4 *** --->
+        <h2>Plots</h2>
+            <p>Selected plots will appear here.</p>  
+
+            ''', inputs["plot_info"], '''
+  
+                    ''', inputs["td_bowtie_html_string"], '''
+            <div class="container">
+                <div class="row">
+                    <div class="col align-self-start">
+
+                    </div>
+                    <div class="col align-self-center">
+                    ''', renders["td_bowtie"], '''
+                    </div>
+                    <div class="col align-self-end">
+
+                    </div>
+                </div>
+            </div>
+
+            ''', inputs["te_bowtie_html_string"], '''
+            <div class="container">
+                <div class="row">
+                    <div class="col align-self-start">
+
+                    </div>
+                    <div class="col align-self-center">
+                    ''', renders["te_bowtie"], '''
+                    </div>
+                    <div class="col align-self-end">
+
+                    </div>
+                </div>
+            </div>
+
+            ''', inputs["t_d_error_nm_html_string"], '''
+            <div class="container">
+                <div class="row">
+                    <div class="col align-self-start">
+
+                    </div>
+                    <div class="col align-self-center">
+                    ''', renders["t_d_error_nm_plot"], '''
+                    </div>
+                    <div class="col align-self-end">
+
+                    </div>
+                </div>
+            </div>
+
+            ''', inputs["t_d_error_pc_html_string"], '''
+            <div class="container">
+                <div class="row">
+                    <div class="col align-self-start">
+
+                    </div>
+                    <div class="col align-self-center">
+                    ''', renders["t_d_error_pc_plot"], '''
+                    </div>
+                    <div class="col align-self-end">
+
+                    </div>
+                </div>
+            </div>
+            
+        
+        <!-- *** Section 4 *** --->
+        <br>
+        <h2>Appendix</h2>
+        <br>
+            <h4>Data analysed as Table</h4> 
+            ''', renders["selected_data"], '''
+            ''', renders["dataframe"], '''
+    </body>
+</html>
+'''
+    )
+
+    names   = {id(render): name for name, render in renders.items()}
+    done    = 0
+    for section in sections:
+        if cancel is not None and cancel.is_set():
+            return False
+        if callable(section):
+            if progress is not None:
+                progress(done / len(renders), "Rendering " + names[id(section)])
+            section = section()
+            done   += 1
+        out.write(section)
+
+    return True
+
+def _remove(path):
+    # Files still open elsewhere cannot be removed on Windows, they are left for the start up sweep
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    _report_files.discard(path)
+
+def _sweep_reports():
+    # Report files this process left behind, and stale ones left by earlier runs that did not exit cleanly
+    for path in list(_report_files):
+        _remove(path)
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), report_prefix + "*")):
+        try:
+            if time.time() - os.path.getmtime(path) > stale_report_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+_sweep_reports()
+atexit.register(_sweep_reports)
+
+def _run(job, inputs):
+    def progress(fraction, text):
+        job["progress"] = (fraction, text)
+
+    try:
+        with (gzip.open(job["path"], "wt", encoding = "utf-8") if job["compress"] else open(job["path"], "w", encoding = "utf-8")) as out:
+            job["ready"] = write_report(inputs, out, progress, job["cancel"])
+    except Exception as error:
+        job["error"] = error
+    job["progress"] = (1.0, "Report ready")
+
+    #The file is closed by now, so a report discarded while it was being written can be deleted
+    with job["lock"]:
+        job["finished"] = True
+        if job["cancel"].is_set():
+            _remove(job["path"])
+
+def start_report(key, inputs, compress = False):
+    '''
+    Write the report to a temporary file in a background thread so reruns of the app are not held up by it, gzip compressed if compress.
+    Returns the job: a dict holding the key it was built for, its (fraction, text) progress, the file's path and name,
+    the flag discard_report cancels it with and, once finished, whether it is ready or the error raised.
+    The bytes of a ready report are read with report_data.
+    '''
+    suffix          = ".html.gz" if compress else ".html"
+    handle, path    = tempfile.mkstemp(prefix = report_prefix, suffix = suffix)
+    os.close(handle)
+    _report_files.add(path)
+
+    job = {"key": key, "progress": (0.0, "Starting"), "path": path, "file_name": "myfile" + suffix, "compress": compress, "ready": False, "error": None,
+           "cancel": threading.Event(), "lock": threading.Lock(), "finished": False, "data": None}
+    job["thread"] = threading.Thread(target = _run, args = (job, inputs), daemon = True)
+    job["thread"].start()
+
+    return job
+
+def report_data(job):
+    '''
+    Bytes of a ready report, read from its file on the first call and kept on the job, so reruns do not read the file again.
+    The file is deleted once read.
+    '''
+    if job["data"] is None:
+        with open(job["path"], "rb") as report_file:
+            job["data"] = report_file.read()
+        _remove(job["path"])
+
+    return job["data"]
+
+def discard_report(job):
+    '''
+    Cancel a report that is no longer wanted and delete its file: straight away if its thread has finished,
+    otherwise the thread stops at its next section and deletes the file once it has closed it
+    '''
+    with job["lock"]:
+        job["cancel"].set()
+        if job["finished"]:
+            _remove(job["path"])
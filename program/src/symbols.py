@@ -76,6 +76,16 @@ idc_symbols = [
     " tesInputData.L2mSensIdc_Idc_MCP"
 ]
 
+time_symbols = [
+    "Time",
+    " Time",
+    "time",
+    "Timestamp",
+    " Timestamp",
+    "Time_s",
+    " Time_s"
+]
+
 loss_inv_comp_symbols = [
     "InverterEfficiency_MCP",
     "InverterEfficiency_IOP"
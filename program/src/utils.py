@@ -1,33 +1,196 @@
+from collections import namedtuple
+
 import numpy as np
-from scipy.interpolate import griddata
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
+from scipy import signal
 import pandas as pd
 import streamlit as st
+from src.ingest import read_header, read_files, chunk_rows
+from src.aggregate import OperatingPoints
+from src.limit_index import LimitIndex
+from src.fingerprint import memoize, cache_key, tag_lineage
+
+@memoize
+def load_columns(uploaded_files):
+    columns = list(dict.fromkeys(col for f in uploaded_files for col in read_header(f)))
+
+    return columns
 
-@st.cache
-def load_dataframe(uploaded_files):
+@memoize
+def load_dataframe(uploaded_files, usecols=None):
     with st.spinner("Generating Dataframe"):
-        try:
-            df = pd.concat( (pd.read_csv(f) for f in uploaded_files), ignore_index=True)
-        except:
-            df = pd.concat( (pd.read_excel(f) for f in uploaded_files), ignore_index=True)
+        if usecols is not None:
+            usecols = list(dict.fromkeys(usecols))
 
-        columns = list(df.columns)
-        columns.append(None)
+        df = read_files(uploaded_files, usecols)
 
-        return df, columns
+        return tag_lineage(df, "load_dataframe", cache_key(uploaded_files), usecols)
 
-def determine_transients(df, t_demanded, torque_demanded_filter, dwell_period):
-    df["Step_Change"] = '0'
-    df["Step_Change"] = df[t_demanded].diff()
-    
-    Step_index          = ( df.index[abs(df['Step_Change']) >= torque_demanded_filter] - 1 )
-    Stop_index          = Step_index + dwell_period
+def time_seconds(df, timestamp):
+    '''
+    Convert a timestamp column to monotonic seconds. Time resets between concatenated files are
+    bridged with the median sample period so the timeline can be searched with searchsorted.
+    '''
+    time = df[timestamp]
+    if time.dtype.kind not in "biuf":
+        time = pd.to_datetime(time)
+        time = (time - time.iloc[0]).dt.total_seconds()
+    time = time.to_numpy(dtype=float)
+
+    period = np.diff(time)
+    if (period <= 0).any():
+        period[period <= 0] = np.median(period[period > 0]) if (period > 0).any() else 1.0
+        time = time[0] + np.concatenate(([0.0], np.cumsum(period)))
+
+    return df.assign(**{timestamp: time})
+
+def sample_rate(df, timestamp):
+    return 1 / np.median(np.diff(df[timestamp].to_numpy()))
+
+def decimate(df, factor, t_demanded, timestamp=None):
+    '''
+    Anti-aliased decimation of every signal by factor before analysis.
+    Demanded torque and time are stepped signals so they are subsampled rather than filtered,
+    which would otherwise smear the torque steps used to find transients.
+    '''
+    if factor <= 1 or len(df) < 64 * factor:
+        return df
+
+    decimated = dict()
+    for col in df.columns:
+        if col in (t_demanded, timestamp):
+            decimated[col] = df[col].to_numpy()[::factor]
+        else:
+            decimated[col] = signal.decimate(df[col].to_numpy(dtype=float), factor, ftype="fir", zero_phase=True)
+
+    return pd.DataFrame(decimated, columns=df.columns)
+
+#Array backed table of torque steps, one entry per segment between consecutive steps.
+#start: sample before the step, stop: end of the transient window, end: start of the next segment.
+SegmentTable = namedtuple("SegmentTable", ["start", "stop", "end"])
+
+def dwell_stop(start, dwell_period, n, time=None):
+    #End of the dwell window in samples, or in seconds when a time array is given
+    if time is None:
+        stop = start + dwell_period
+    else:
+        stop = np.searchsorted(time, time[start] + dwell_period)
+
+    return np.minimum(stop, n)
+
+def determine_transients(df, t_demanded, torque_demanded_filter, dwell_period, timestamp=None):
+    demanded            = df[t_demanded].to_numpy(dtype=float)
+    step_change         = np.diff(demanded)
+    time                = df[timestamp].to_numpy() if timestamp is not None else None
+
+    start               = np.flatnonzero(abs(step_change) >= torque_demanded_filter)
+    end                 = np.append(start[1:], len(demanded))
+    stop                = dwell_stop(start, dwell_period, len(demanded), time)
 
-    return Step_index, Stop_index
+    return SegmentTable(start, stop, end)
 
-def sample_transients(Step_index, Stop_index, df, test_dict):
+def settle_segments(segments, df, t_measured, band, window, timestamp=None):
+    '''
+    Replace the fixed dwell stop of each segment with the sample where measured torque enters and stays
+    within band of its settled value (the mean of the last window samples, or window seconds if timestamp is given, of the segment).
+    Rolling means are computed for all segments at once from a single cumsum.
+    '''
+    if len(segments.start) == 0:
+        return segments
+
+    measured    = df[t_measured].to_numpy(dtype=float)
+    first       = segments.start[0]
+
+    seg         = np.repeat(np.arange(len(segments.start)), segments.end - segments.start)
+    pos         = np.arange(first, len(measured))
+
+    #Rolling mean over the previous window samples (or seconds), truncated at the start of each segment
+    csum        = np.concatenate(([0.0], np.cumsum(measured)))
+    if timestamp is None:
+        lo      = pos - window + 1
+    else:
+        time    = df[timestamp].to_numpy()
+        lo      = np.searchsorted(time, time[pos] - window, side="right")
+    lo          = np.minimum(np.maximum(lo, segments.start[seg]), pos)
+    rolling     = (csum[pos + 1] - csum[lo]) / (pos + 1 - lo)
 
-    transient_sample = df.iloc[ Step_index[test_dict["Sample"]]-250 : Stop_index[test_dict["Sample"]]+250 ]
+    settled     = rolling[segments.end - 1 - first]
+    outside     = abs(rolling - settled[seg]) > band
+
+    #Last sample outside the band in each segment, the segment has settled from the one after
+    last_out    = np.maximum.reduceat(np.where(outside, pos, -1), segments.start - first)
+    stop        = np.maximum(last_out + 1, segments.start)
+
+    return segments._replace(stop=stop)
+
+def dwell_sweep(segments, df, t_demanded, t_measured, dwell_periods, timestamp=None):
+    '''
+    For every candidate dwell period, the percentage of samples removed and the mean per segment
+    standard deviation of the remaining torque error, evaluated for all candidates at once.
+    The suggested dwell period is the shortest one whose spread is within 10% of the minimum spread,
+    among candidates that leave at least 90% of the segments with data.
+    Candidates are evaluated in blocks of at most chunk_rows candidate-segment pairs to bound memory.
+    '''
+    dwell_periods   = np.asarray(dwell_periods)
+    start, end      = segments.start, segments.end
+    n               = len(df)
+    time            = df[timestamp].to_numpy() if timestamp is not None else None
+
+    error           = df[t_measured].to_numpy(dtype=float) - df[t_demanded].to_numpy(dtype=float)
+    sum_error       = np.concatenate(([0.0], np.cumsum(error)))
+    sum_sq_error    = np.concatenate(([0.0], np.cumsum(error * error)))
+
+    removed         = np.zeros(len(dwell_periods))
+    spread          = np.zeros(len(dwell_periods))
+    usable          = np.zeros(len(dwell_periods))
+    block           = max(chunk_rows // max(len(start), 1), 1)
+    for first in range(0, len(dwell_periods), block):
+        dwell       = dwell_periods[first : first + block, None]
+        rows        = slice(first, first + block)
+
+        #First kept sample of every segment for every candidate, segments are contiguous so removals never overlap
+        if time is None:
+            lo      = np.minimum(start[None, :] + dwell, end[None, :])
+        else:
+            lo      = np.minimum(np.searchsorted(time, time[start][None, :] + dwell), end[None, :])
+        removed[rows] = (lo - start[None, :]).sum(axis=1)
+
+        count       = end[None, :] - lo
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean        = (sum_error[end][None, :] - sum_error[lo]) / count
+            variance    = (sum_sq_error[end][None, :] - sum_sq_error[lo]) / count - mean**2
+            deviation   = np.where(count > 1, np.sqrt(np.maximum(variance, 0)), 0)
+            spread[rows] = deviation.sum(axis=1) / (count > 1).sum(axis=1)
+            usable[rows] = (count > 1).sum(axis=1) / len(start)
+
+    sweep = pd.DataFrame({
+                        "Dwell Period"          : dwell_periods,
+                        "Samples Removed [%]"   : removed / n * 100,
+                        "Error Spread [Nm]"     : spread
+                        })
+
+    #Only candidates that leave most segments with data are comparable
+    finite = np.isfinite(spread) & (usable >= 0.9)
+    if finite.any():
+        threshold   = 1.1 * np.min(spread[finite])
+        suggested   = dwell_periods[np.flatnonzero(finite & (spread <= threshold))[0]].item()
+    else:
+        suggested   = None
+
+    return sweep, suggested
+
+def sample_transients(segments, df, test_dict, timestamp=None):
+
+    sample              = test_dict["Sample"]
+    if timestamp is None:
+        transient_sample    = df.iloc[ max(segments.start[sample]-250, 0) : segments.stop[sample]+250 ]
+    else:
+        #Pad the window by 0.25s either side, 250 samples at 1kHz
+        time                = df[timestamp].to_numpy()
+        lo                  = np.searchsorted(time, time[segments.start[sample]] - 0.25)
+        hi                  = np.searchsorted(time, time[min(segments.stop[sample], len(time) - 1)] + 0.25)
+        transient_sample    = df.iloc[ lo : hi ]
     
     return transient_sample
 
@@ -38,137 +201,355 @@ def col_removal(data, list_to_keep):
 
     return data
 
-def transient_removal(df, Step_index, Stop_index):
+def interval_mask(n, start, stop):
+    '''
+    Boolean mask of length n that is False inside any [start, stop) interval.
+    Built with a difference array and cumsum so overlapping intervals merge, in O(n + k).
+    '''
+    start   = np.clip(np.asarray(start, dtype=np.int64), 0, n)
+    stop    = np.clip(np.asarray(stop, dtype=np.int64), 0, n)
+    valid   = start < stop
+
+    delta   = np.bincount(start[valid], minlength=n+1) - np.bincount(stop[valid], minlength=n+1)
+
+    return np.cumsum(delta[:n]) == 0
+
+def transient_removal(df, segments):
     
 #Transient Removal
-    delete_slice = np.array(0)
+    keep = interval_mask(len(df), segments.start, segments.stop)
 
-    for x in range( len(Step_index) ):
-        temp_slice = np.arange(Step_index[x], Stop_index[x])
-        delete_slice = np.append(delete_slice, temp_slice)
+    return df[keep]
 
-    delete_slice = abs(delete_slice)
-    df = df.drop(index = delete_slice)
-    return df
+def segment_reduce(df, segments, tail, timestamp=None):
+    '''
+    Average the last tail samples (or tail seconds if timestamp is given) of every segment, after its transient, into one row per segment.
+    Segment sums come from a single np.add.reduceat over interleaved [lo, hi) boundaries per column.
+    '''
+    hi      = segments.end
+    if timestamp is None:
+        lo  = hi - tail
+    else:
+        time    = df[timestamp].to_numpy()
+        lo      = np.searchsorted(time, time[hi - 1] - tail)
+    lo      = np.minimum(np.maximum(lo, segments.stop), hi)
+    valid   = lo < hi
+    lo, hi  = lo[valid], hi[valid]
 
-def myround(x, base):
-    return base * round(x/base)
+    if len(lo) == 0:
+        return df.iloc[0:0]
 
-def round_speeds(df, speed_signal, torque_demanded_signal, base):
-    # Round measured speed to the nearest 50rpm.
-    
-    df[speed_signal + " Rounded"] = myround(df[speed_signal], base)
+    #reduceat sums to the end of the array after the last index, so a final boundary at len(df) is dropped
+    boundaries = np.column_stack([lo, hi]).ravel()
+    if boundaries[-1] == len(df):
+        boundaries = boundaries[:-1]
 
-    # Group the data in the dataframe by the measured speed (rounded) and torque demanded.
-    # Get average of all data within those subgroups and create new dataframe, df.
-    df = df.groupby([speed_signal + " Rounded", torque_demanded_signal], as_index=False).agg("mean")
+    samples = hi - lo
+    reduced = { col: np.add.reduceat(df[col].to_numpy(dtype=float), boundaries)[::2] / samples for col in df.columns }
 
-    return df
+    return pd.DataFrame(reduced, columns=df.columns)
+
+def myround(x, base):
+    return base * np.round(x/base)
+
+def round_operating_points(df, torque_demanded_signal, bases, spread=()):
+    # Round each signal in bases (e.g. measured speed, DC voltage) to the nearest multiple of its base.
+    # Group the data by the rounded signals and torque demanded, chunk by chunk so the rounded copies are only ever one chunk long.
+    # Get average of all data within those subgroups and create new dataframe, df,
+    # plus the sample count and the spread (std, min, max) of the signals in spread within each subgroup.
+    rounded = [signal + " Rounded" for signal in bases]
+    values  = [col for col in df.columns if col != torque_demanded_signal]
+    points  = OperatingPoints(rounded[:1] + [torque_demanded_signal] + rounded[1:], values, spread)
+
+    #Columns are taken by position from one array per chunk, which for an all float frame is a view rather than a copy,
+    #and the value columns are gathered column major so each one stays contiguous
+    data            = [df.columns.get_loc(col) for col in values]
+    key_signals     = [df.columns.get_loc(signal) for signal in bases]
+    key_torque      = df.columns.get_loc(torque_demanded_signal)
+    for lo in range(0, len(df), chunk_rows):
+        chunk   = df.iloc[lo : lo + chunk_rows].to_numpy(dtype=float)
+        keys    = [myround(chunk[:, col], base) for col, base in zip(key_signals, bases.values())]
+        points.update(np.column_stack(keys[:1] + [chunk[:, key_torque]] + keys[1:]), chunk.T[data].T)
+
+    return points.to_frame(), points.statistics()
+
+def voltage_accuracy(df, voltage_round, errors):
+    '''
+    Absolute mean and maximum of each error at every rounded voltage point
+    '''
+    voltages, inverse   = np.unique(df[voltage_round].to_numpy(), return_inverse=True)
+    inverse             = inverse.reshape(-1)
+    points              = np.bincount(inverse, minlength=len(voltages))
+
+    table = pd.DataFrame({voltage_round: voltages, "Operating Points": points})
+    for error in errors:
+        error_abs                       = np.abs(df[error].to_numpy(dtype=float))
+        valid                           = ~np.isnan(error_abs)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            table["Mean " + error]      = np.bincount(inverse[valid], weights=error_abs[valid], minlength=len(voltages)) / np.bincount(inverse[valid], minlength=len(voltages))
+        max_error                       = np.full(len(voltages), np.nan)
+        np.fmax.at(max_error, inverse, error_abs)
+        table["Max " + error]           = max_error
+
+    return table
+
+def torque_error_kernel(reference, measured, out_nm, out_pc, reference_is_output):
+    '''
+    Nm and % error of a reference torque against measured torque, written into the preallocated out_nm and out_pc.
+    The Nm error is signed so that over delivery in either direction is positive, % errors with a zero denominator are NaN.
+    '''
+    if reference_is_output:
+        # Demanded: measured - demanded (demanded - measured when negative), (demanded - measured) / measured
+        np.subtract(measured, reference, out=out_nm)
+        np.subtract(reference, measured, out=out_pc)
+        denominator = measured
+    else:
+        # Estimated: estimated - measured (measured - estimated when negative), (measured - estimated) / estimated
+        np.subtract(reference, measured, out=out_nm)
+        np.subtract(measured, reference, out=out_pc)
+        denominator = reference
+    np.negative(out_nm, out=out_nm, where=reference < 0)
+
+    zero = denominator == 0
+    np.divide(out_pc, denominator, out=out_pc, where=~zero)
+    np.multiply(out_pc, 100, out=out_pc)
+    out_pc[zero] = np.nan
 
 def torque_error_calc(df, t_demanded, t_estimated, t_measured, t_demanded_error_nm, t_demanded_error_pc, t_estimated_error_nm, t_estimated_error_pc):
-    df[t_demanded_error_nm]    = 0
-    df[t_demanded_error_nm]    = df[t_demanded_error_nm].where(df[t_demanded] >= 0, df[t_demanded] - df[t_measured])
-    df[t_demanded_error_nm]    = df[t_demanded_error_nm].where(df[t_demanded] < 0, df[t_measured] - df[t_demanded])
-    df[t_demanded_error_pc]    = ( (df[t_demanded] - df[t_measured]) / df[t_measured]) * 100
+    measured    = df[t_measured].to_numpy(dtype=float)
+    errors      = np.empty((4, len(df)))
 
-    df[t_estimated_error_nm]   = 0
-    df[t_estimated_error_nm]   = df[t_estimated_error_nm].where(df[t_estimated] >= 0, df[t_measured] - df[t_estimated])
-    df[t_estimated_error_nm]   = df[t_estimated_error_nm].where(df[t_estimated] < 0, df[t_estimated] - df[t_measured])
-    df[t_estimated_error_pc]   =  ( (df[t_measured] - df[t_estimated]) / df[t_estimated]) * 100
+    torque_error_kernel(df[t_demanded].to_numpy(dtype=float), measured, errors[0], errors[1], True)
+    df[t_demanded_error_nm]    = errors[0]
+    df[t_demanded_error_pc]    = errors[1]
+
+    if t_estimated in df:
+        torque_error_kernel(df[t_estimated].to_numpy(dtype=float), measured, errors[2], errors[3], False)
+        df[t_estimated_error_nm]   = errors[2]
+        df[t_estimated_error_pc]   = errors[3]
 
     return df
 
-def error_nm_analysis(df, limit_nm, limit_pc, t_to_analyse ,t_demanded, t_estimated, t_measured, speed_round, vdc, idc, error_nm, error_pc):
+def _descending(values):
+    # Sort key putting the largest absolute value first and NaN last
+    key = -np.abs(values)
+    key[np.isnan(key)] = np.inf
+    return key
 
-    if ( abs(df[error_nm]) > limit_nm ).any():
-    
-        error_table_nm = df[abs(df[error_nm]) > limit_nm].copy()
-    
-        if ( abs(error_table_nm[t_to_analyse]) <= (limit_nm/(limit_pc/100)) ).any():
-            
-            error_table_nm = error_table_nm[abs(error_table_nm[t_to_analyse]) <= (limit_nm/(limit_pc/100))].copy()
-            error_table_nm.sort_values(by=error_nm, key = abs, ascending = False, inplace = True)
-            error_table_nm = error_table_nm.filter([error_nm, error_pc, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
-            
-            flag = False
+def _worst_rows(rows, top, *keys):
+    # Rows ordered by the keys (primary first), keeping only the top rows. A partial partition finds the top-th primary key,
+    # and every row tied with it goes through the full sort too, so the secondary keys and row order settle ties at the cut.
+    if top is not None and len(rows) > top:
+        primary = keys[0][rows]
+        rows    = rows[primary <= np.partition(primary, top - 1)[top - 1]]
 
+    return rows[np.lexsort([key[rows] for key in reversed(keys)])][:top]
+
+def error_analysis(df, checks, columns, top=5):
+    '''
+    Evaluate every error check in one pass over df, each check being (t_to_analyse, error_nm, error_pc, limit_nm, limit_pc, unit) with unit "Nm" or "%".
+    Nm errors are judged where |t_to_analyse| <= limit_nm / limit_pc and % errors above it. When no point in its region violates the limit
+    the check passes (flag True) and only the top worst points are kept, otherwise every violating point is listed, worst first.
+    Returns (error_table, min_error, average_error, max_error, flag) for each check.
+    '''
+    magnitude   = dict()
+    descending  = dict()
+    for col in set(col for check in checks for col in check[:3]):
+        values          = df[col].to_numpy(dtype=float)
+        magnitude[col]  = np.abs(values)
+        descending[col] = _descending(values)
+
+    all_rows    = np.arange(len(df))
+    results     = []
+
+    for t_to_analyse, error_nm, error_pc, limit_nm, limit_pc, unit in checks:
+        error, other, limit = (error_nm, error_pc, limit_nm) if unit == "Nm" else (error_pc, error_nm, limit_pc)
+        boundary            = limit_nm/(limit_pc/100)
+        in_region           = magnitude[t_to_analyse] <= boundary if unit == "Nm" else magnitude[t_to_analyse] > boundary
+        violation           = magnitude[error] > limit
+
+        if violation.any():
+            failing = np.flatnonzero(violation & in_region)
+            if len(failing) > 0:
+                rows = _worst_rows(failing, None, descending[error])
+                flag = False
+            else:
+                # Nm: the worst points within the Nm region, %: the worst % violations outside the % region
+                rows = _worst_rows(np.flatnonzero(in_region if unit == "Nm" else violation), top, descending[error])
+                flag = True
         else:
-            
-            error_table_nm = df[abs(df[t_to_analyse]) <= (limit_nm/(limit_pc/100))].copy()
-            error_table_nm.sort_values(by=error_nm,key = abs, ascending = False, inplace = True)
-            error_table_nm = error_table_nm[0:5]
-            error_table_nm = error_table_nm.filter([error_nm, error_pc, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
-            
+            rows = _worst_rows(all_rows, top, descending[error], descending[other])
             flag = True
 
-    else:
-        error_table_nm = df.copy()
-        error_table_nm.sort_values(by=[error_nm, error_pc],key = abs, ascending = False, inplace = True)
-        error_table_nm = error_table_nm[0:5]
-        error_table_nm = error_table_nm.filter([error_nm, error_pc, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
-        
-        flag = True
+        error_table = df.iloc[rows].filter([error, other] + columns)
+        worst       = magnitude[error][rows]
+        worst       = worst[~np.isnan(worst)]
+        if len(worst) > 0:
+            results.append((error_table, worst.min(), worst.mean(), worst.max(), flag))
+        else:
+            results.append((error_table, np.nan, np.nan, np.nan, flag))
 
-    min_error       = min(abs(error_table_nm[error_nm]))
-    average_error   = np.mean(abs(error_table_nm[error_nm]))
-    max_error       = max(abs(error_table_nm[error_nm]))
+    return results
 
-    return error_table_nm, min_error, average_error, max_error, flag
+quadrants = ["Forward Motoring", "Reverse Generating", "Reverse Motoring", "Forward Generating"]
 
-def error_pc_analysis(df, limit_nm, limit_pc, t_to_analyse, t_demanded, t_estimated, t_measured, speed_round, vdc, idc, error_nm, error_pc):
+def quadrant_accuracy(df, speed_signal, t_to_analyse, error_nm, error_pc, limit_nm, limit_pc, top=5):
+    '''
+    Error statistics of every operating quadrant (sign of speed x sign of torque) from grouped reductions over a single quadrant code,
+    and the top worst failing points of each quadrant. As in the pass/fail pie charts, a point passes when both its Nm and % errors
+    are within their limits and fails when both are outside.
+    Returns (table, violators).
+    '''
+    torque          = df[t_to_analyse].to_numpy(dtype=float)
+    reverse         = df[speed_signal].to_numpy(dtype=float) < 0
+    nm              = np.abs(df[error_nm].to_numpy(dtype=float))
+    pc              = np.abs(df[error_pc].to_numpy(dtype=float))
+
+    # 0: +speed +torque, 1: -speed +torque, 2: -speed -torque, 3: +speed -torque
+    code            = np.where(torque < 0, 3 - reverse, reverse.astype(int))
+    points          = np.bincount(code, minlength=4)
+
+    #Comparisons with NaN are False, so points with a NaN error neither pass nor fail
+    passed          = (nm <= limit_nm) & (pc <= limit_pc)
+    fail            = (nm > limit_nm) & (pc > limit_pc)
+
+    table = pd.DataFrame({"Quadrant": quadrants, "Operating Points": points})
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name, error in [("Nm", nm), ("%", pc)]:
+            valid                                   = ~np.isnan(error)
+            minimum, maximum                        = np.full(4, np.inf), np.full(4, -np.inf)
+            np.minimum.at(minimum, code[valid], error[valid])
+            np.maximum.at(maximum, code[valid], error[valid])
+            table["Minimum Error [" + name + "]"]   = np.where(np.isinf(minimum), np.nan, minimum)
+            table["Mean Error [" + name + "]"]      = np.bincount(code[valid], weights=error[valid], minlength=4) / np.bincount(code[valid], minlength=4)
+            table["Maximum Error [" + name + "]"]   = np.where(np.isinf(maximum), np.nan, maximum)
+
+    table["Pass"] = np.bincount(code, weights=passed, minlength=4).astype(int)
+    table["Fail"] = np.bincount(code, weights=fail, minlength=4).astype(int)
+
+    # A failing point is as far outside the limits as the nearer of its two errors
+    failing         = np.flatnonzero(fail)
+    severity        = np.minimum(nm[failing] / limit_nm, pc[failing] / limit_pc)
+
+    # Top failing points per quadrant: sorted by code then descending severity, ranked from the start of each code's run
+    order           = np.lexsort((_descending(severity), code[failing]))
+    sorted_code     = code[failing][order]
+    rank            = np.arange(len(order)) - np.searchsorted(sorted_code, sorted_code)
+    keep            = order[rank < top]
+    worst           = failing[keep]
+
+    violators = pd.DataFrame({
+                            "Quadrant"          : np.array(quadrants)[code[worst]],
+                            speed_signal        : df[speed_signal].to_numpy(dtype=float)[worst],
+                            t_to_analyse        : torque[worst],
+                            error_nm            : df[error_nm].to_numpy(dtype=float)[worst],
+                            error_pc            : df[error_pc].to_numpy(dtype=float)[worst],
+                            "Error / Limit"     : severity[keep]
+                            })
+
+    return table, violators
+
+@memoize
+def build_limit_index(df, error_nm, error_pc):
+    return LimitIndex(df[error_nm].to_numpy(), df[error_pc].to_numpy())
+
+def lattice_index(x, y, min_occupancy=0.5):
+    '''
+    If the points sit on a lattice of distinct x and y values (e.g. rounded speed x demanded torque steps), return those values and
+    the column and row of every point, otherwise None
+    '''
+    xi, col = np.unique(np.asarray(x, dtype=float), return_inverse=True)
+    yi, row = np.unique(np.asarray(y, dtype=float), return_inverse=True)
+    col, row = col.reshape(-1), row.reshape(-1)
 
-    if ( abs(df[error_pc]) > limit_pc ).any():
-    
-        error_table_pc = df[abs(df[error_pc]) > limit_pc].copy()
-        
-        if ( abs(error_table_pc[t_to_analyse]) > (limit_nm/(limit_pc/100)) ).any():
-        
-            error_table_pc = error_table_pc[abs(error_table_pc[t_to_analyse]) > (limit_nm/(limit_pc/100))].copy()
-            error_table_pc.sort_values(by=error_pc, key = abs, ascending = False, inplace = True)
-            error_table_pc = error_table_pc.filter([error_pc, error_nm, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
-
-            flag = False
-            
-        else:
+    if len(xi) < 2 or len(yi) < 2:
+        return None
+    if len(np.unique(row * len(xi) + col)) < min_occupancy * len(xi) * len(yi):
+        return None
 
-            error_table_pc.sort_values(by=error_pc,key = abs, ascending = False, inplace = True)
-            error_table_pc = error_table_pc[0:5]
-            error_table_pc = error_table_pc.filter([error_pc, error_nm, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
+    return xi, yi, col, row
 
-            flag = True
-    else:
+#Grid points per axis sent to the browser for a surface, whatever resolution is requested
+max_grid_res = 200
 
+@memoize
+def triangulate(df, x_col, y_col):
+    '''
+    Delaunay triangulation of the points, computed once per dataset whatever grid it is later sampled on
+    '''
+    return Delaunay(df[[x_col, y_col]].to_numpy(dtype=float))
+
+@memoize
+def grid_weights(tri, grid_res, x_range=None, y_range=None):
+    '''
+    Containing simplex and barycentric weights of every node of a grid_res x grid_res grid over the triangulated points,
+    so each surface only needs a weighted sum of its vertex values
+    '''
+    x_range = x_range or (tri.points[:, 0].min(), tri.points[:, 0].max())
+    y_range = y_range or (tri.points[:, 1].min(), tri.points[:, 1].max())
 
-        error_table_pc = df.copy()
-        error_table_pc.sort_values(by=[error_pc, error_nm],key = abs, ascending = False, inplace = True)
-        error_table_pc = error_table_pc[0:5]
-        error_table_pc = error_table_pc.filter([error_pc, error_nm, t_measured, t_demanded, t_estimated, speed_round, vdc, idc])
+    xi      = np.linspace( float(x_range[0]), float(x_range[1]), grid_res )
+    yi      = np.linspace( float(y_range[0]), float(y_range[1]), grid_res )
+    X,Y     = np.meshgrid(xi,yi)
+    nodes   = np.column_stack([X.ravel(), Y.ravel()])
 
-        flag = True
+    simplex = tri.find_simplex(nodes)
+    affine  = tri.transform[simplex]
+    bary    = np.einsum("nij,nj->ni", affine[:, :2], nodes - affine[:, 2])
+    weights = np.column_stack([bary, 1 - bary.sum(axis=1)])
 
-    min_error       = min(abs(error_table_pc[error_pc]))
-    average_error   = np.mean(abs(error_table_pc[error_pc]))
-    max_error       = max(abs(error_table_pc[error_pc]))
-    
-    return error_table_pc, min_error, average_error, max_error, flag
+    return xi, yi, nodes, tri.simplices[simplex], weights, simplex >= 0
 
-def z_col_or_grid(chart_type, fill, method, grid_res, x_in, y_in, z_in):
+def z_col_or_grid(chart_type, fill, method, grid_res, df, x_col, y_col, z_col, x_range=None, y_range=None):
     '''
-    Depending on graph wanted, format data as grid or columns
+    Depending on graph wanted, format the x_col, y_col and z_col columns of df as grid or columns.
+    Lattice data is pivoted into its grid as measured, scattered data is interpolated onto a grid_res x grid_res grid.
+    Grids cover x_range x y_range (all the data if None) and never exceed max_grid_res per axis, so zooming in refines the region.
     '''
-    x = x_in
-    y = y_in
-    z = z_in
+    x = df[x_col]
+    y = df[y_col]
+    z = df[z_col]
+    grid_res = min(int(grid_res), max_grid_res)
 
+    lattice = None
     if chart_type != '3D Scatter':
+        x_all, y_all    = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        zoomed          = np.ones(len(x_all), dtype=bool)
+        if x_range is not None:
+            zoomed &= (x_all >= x_range[0]) & (x_all <= x_range[1])
+        if y_range is not None:
+            zoomed &= (y_all >= y_range[0]) & (y_all <= y_range[1])
+        lattice = lattice_index(x_all[zoomed], y_all[zoomed])
+        if lattice is not None and len(lattice[0]) * len(lattice[1]) > max_grid_res**2:
+            lattice = None
+
+    if lattice is not None:
+        # Pivot straight into the grid, averaging any repeated point and filling empty cells
+        xi, yi, col, row    = lattice
+        cell                = row * len(xi) + col
+        values              = np.asarray(z, dtype=float)[zoomed]
+        valid               = ~np.isnan(values)
+        count               = np.bincount(cell[valid], minlength=len(xi) * len(yi))
+        total               = np.bincount(cell[valid], weights=values[valid], minlength=len(xi) * len(yi))
+        z                   = np.full(len(xi) * len(yi), float(fill))
+        np.divide(total, count, out=z, where=count > 0)
+        z = z.reshape(len(yi), len(xi))
+        x = xi
+        y = yi
 
-        xi = np.linspace( float(min(x)), float(max(x)), int(grid_res) )
-        yi = np.linspace( float(min(y)), float(max(y)), int(grid_res) )
+    elif chart_type != '3D Scatter':
 
-        X,Y = np.meshgrid(xi,yi)
+        tri                                     = triangulate(df, x_col, y_col)
+        xi, yi, nodes, vertices, weights, inside = grid_weights(tri, grid_res, x_range, y_range)
+        values = np.asarray(z, dtype=float)
 
-        z = griddata( (x,y),z,(X,Y), fill_value=fill, method=method)  
+        if method == "linear":
+            z = np.einsum("nj,nj->n", values[vertices], weights)
+            z[~inside] = float(fill)
+        else:
+            z = CloughTocher2DInterpolator(tri, values, fill_value=float(fill))(nodes)
+        z = z.reshape(len(yi), len(xi))
         x = xi
         y = yi
 
-    return x, y, z
\ No newline at end of file
+    return x, y, z
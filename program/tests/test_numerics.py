@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay
+
+from src import utils
+from src.aggregate import OperatingPoints
+from src.limit_index import LimitIndex
+from src.utils import interval_mask, segment_reduce, error_analysis, round_operating_points, SegmentTable
+
+#Small integer values so limits, errors and sort keys tie often
+sizes = [0, 1, 2, 7, 50, 300]
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+def _errors(rng, n):
+    values = rng.integers(-5, 6, n).astype(float)
+    values[rng.random(n) < 0.1] = np.nan
+    return values
+
+@pytest.mark.parametrize("n", sizes)
+def test_limit_index_counts(rng, n):
+    for _ in range(20):
+        err_nm, err_pc  = _errors(rng, n), _errors(rng, n)
+        index           = LimitIndex(err_nm, err_pc)
+        nm, pc          = np.abs(err_nm), np.abs(err_pc)
+        for limit_nm in np.arange(-1, 7):
+            for limit_pc in np.arange(-1, 7):
+                expected = (int(((nm <= limit_nm) & (pc <= limit_pc)).sum()), int(((nm > limit_nm) & (pc > limit_pc)).sum()))
+                assert index.counts(limit_nm, limit_pc) == expected
+
+@pytest.mark.parametrize("n", sizes)
+def test_interval_mask(rng, n):
+    for _ in range(50):
+        k           = rng.integers(0, 6)
+        start       = rng.integers(-3, n + 3, k)
+        stop        = start + rng.integers(-2, 8, k)
+        expected    = np.ones(n, dtype=bool)
+        for lo, hi in zip(start, stop):
+            expected[max(lo, 0) : max(hi, 0)] = False
+        assert (interval_mask(n, start, stop) == expected).all()
+
+def _segments(rng, n):
+    # Back to back segments covering the data, each with a transient of random length
+    ends    = np.unique(np.append(rng.integers(1, n + 1, rng.integers(1, 6)), n)) if n > 0 else np.array([], dtype=int)
+    starts  = np.append(0, ends[:-1]).astype(int)[:len(ends)]
+    stops   = starts + rng.integers(0, 6, len(ends))
+    return SegmentTable(starts, stops, ends)
+
+@pytest.mark.parametrize("n", sizes)
+@pytest.mark.parametrize("timed", [False, True])
+def test_segment_reduce(rng, n, timed):
+    for _ in range(20):
+        df          = pd.DataFrame({"Time": np.cumsum(rng.integers(1, 3, n)) * 0.5, "Speed": rng.normal(size=n), "Torque": rng.normal(size=n)})
+        segments    = _segments(rng, n)
+        tail        = rng.integers(0, 5) * (0.5 if timed else 1)
+        reduced     = segment_reduce(df, segments, tail, "Time" if timed else None)
+
+        expected = []
+        for start, stop, end in zip(segments.start, segments.stop, segments.end):
+            rows = df.iloc[start:end].iloc[stop - start:]
+            if timed:
+                rows = rows[rows["Time"] >= df["Time"].iloc[end - 1] - tail]
+            else:
+                rows = rows.iloc[max(len(rows) - int(tail), 0):]
+            if len(rows) > 0:
+                expected.append(rows.mean())
+        expected = pd.DataFrame(expected, columns=df.columns)
+
+        assert len(reduced) == len(expected)
+        np.testing.assert_allclose(reduced.to_numpy(dtype=float), expected.to_numpy(dtype=float))
+
+@pytest.mark.parametrize("n", sizes)
+@pytest.mark.parametrize("timed", [False, True])
+def test_settle_segments(rng, n, timed):
+    for _ in range(20):
+        #Integer torque keeps the cumsum exact, so rolling means match the direct ones bit for bit
+        df          = pd.DataFrame({"Time": np.cumsum(rng.integers(1, 3, n)) * 0.5, "Torque": rng.integers(-5, 6, n).astype(float)})
+        segments    = _segments(rng, n)
+        band        = rng.integers(0, 4) * 0.5
+        window      = rng.integers(1, 5) * (0.5 if timed else 1)
+        settled     = utils.settle_segments(segments, df, "Torque", band, window, "Time" if timed else None)
+
+        measured, time  = df["Torque"].to_numpy(), df["Time"].to_numpy()
+        expected        = []
+        for start, end in zip(segments.start, segments.end):
+            def rolling(pos):
+                lo = np.flatnonzero(time > time[pos] - window)[0] if timed else pos - window + 1
+                return measured[min(max(lo, start), pos) : pos + 1].mean()
+            outside = [pos for pos in range(start, end) if abs(rolling(pos) - rolling(end - 1)) > band]
+            expected.append(outside[-1] + 1 if outside else start)
+
+        np.testing.assert_array_equal(settled.stop, expected)
+        np.testing.assert_array_equal(settled.start, segments.start)
+        np.testing.assert_array_equal(settled.end, segments.end)
+
+@pytest.mark.parametrize("n", sizes)
+@pytest.mark.parametrize("timed", [False, True])
+@pytest.mark.parametrize("chunk", [1, 7, 200000])
+def test_dwell_sweep(rng, n, timed, chunk, monkeypatch):
+    monkeypatch.setattr(utils, "chunk_rows", chunk)
+    for _ in range(20):
+        df              = pd.DataFrame({"Time": np.cumsum(rng.integers(1, 3, n)) * 0.5, "Demanded": rng.integers(-5, 6, n).astype(float), "Torque": rng.normal(size=n)})
+        segments        = _segments(rng, n)
+        dwell_periods   = np.arange(0, 8) * (0.5 if timed else 1)
+        sweep, suggested = utils.dwell_sweep(segments, df, "Demanded", "Torque", dwell_periods, "Time" if timed else None)
+
+        error, time     = (df["Torque"] - df["Demanded"]).to_numpy(), df["Time"].to_numpy()
+        removed, spread, usable = [], [], []
+        for dwell in dwell_periods:
+            kept = []
+            for start, end in zip(segments.start, segments.end):
+                lo = np.searchsorted(time, time[start] + dwell) if timed else start + dwell
+                kept.append(error[min(lo, end) : end])
+            removed.append((n - sum(len(rows) for rows in kept)) / max(n, 1) * 100)
+            stds = [rows.std() for rows in kept if len(rows) > 1]
+            spread.append(np.mean(stds) if stds else np.nan)
+            usable.append(len(stds) >= 0.9 * len(kept) and stds)
+
+        assert list(sweep["Dwell Period"]) == list(dwell_periods)
+        if n > 0:
+            np.testing.assert_allclose(sweep["Samples Removed [%]"], removed)
+        np.testing.assert_allclose(sweep["Error Spread [Nm]"], spread, atol=1e-9)
+
+        candidates = [i for i in range(len(dwell_periods)) if usable[i]]
+        if candidates:
+            threshold = 1.1 * min(spread[i] for i in candidates)
+            assert suggested == dwell_periods[next(i for i in candidates if spread[i] <= threshold)]
+        else:
+            assert suggested is None
+
+@pytest.mark.parametrize("n", sizes)
+def test_torque_error_calc(rng, n):
+    columns = ["Demanded Error [Nm]", "Demanded Error [%]", "Estimated Error [Nm]", "Estimated Error [%]"]
+    for _ in range(20):
+        df          = pd.DataFrame({name: _errors(rng, n) for name in ["Demanded", "Estimated", "Measured"]})
+        result      = utils.torque_error_calc(df.copy(), "Demanded", "Estimated", "Measured", *columns)
+
+        #The pandas formulation the kernel replaced, with a zero denominator giving NaN rather than inf
+        d, e, m     = df["Demanded"], df["Estimated"], df["Measured"]
+        expected    = pd.DataFrame({
+                                    columns[0] : (m - d).where(d >= 0, d - m),
+                                    columns[1] : ((d - m) / m * 100).where(m != 0),
+                                    columns[2] : (e - m).where(e >= 0, m - e),
+                                    columns[3] : ((m - e) / e * 100).where(e != 0)
+                                    })
+
+        pd.testing.assert_frame_equal(result[columns], expected)
+
+@pytest.mark.parametrize("n", sizes)
+def test_quadrant_accuracy(rng, n):
+    for _ in range(20):
+        df                  = pd.DataFrame({name: _errors(rng, n) for name in ["Speed", "Torque", "Err Nm", "Err %"]})
+        limit_nm, limit_pc  = rng.integers(1, 4, 2)
+        top                 = rng.integers(1, 4)
+        table, violators    = utils.quadrant_accuracy(df, "Speed", "Torque", "Err Nm", "Err %", limit_nm, limit_pc, top)
+
+        reverse, generating = df["Speed"] < 0, df["Torque"] < 0
+        quadrant = np.select([~reverse & ~generating, reverse & ~generating, reverse & generating], [0, 1, 2], 3)
+        nm, pc   = df["Err Nm"].abs(), df["Err %"].abs()
+        fail     = (nm > limit_nm) & (pc > limit_pc)
+        expected_violators = []
+        for code, name in enumerate(utils.quadrants):
+            rows = quadrant == code
+            row  = table.iloc[code]
+            assert row["Quadrant"] == name
+            assert row["Operating Points"] == rows.sum()
+            assert row["Pass"] == ((nm <= limit_nm) & (pc <= limit_pc))[rows].sum()
+            assert row["Fail"] == fail[rows].sum()
+            for unit, error in [("Nm", nm), ("%", pc)]:
+                np.testing.assert_allclose([row["Minimum Error [" + unit + "]"], row["Mean Error [" + unit + "]"], row["Maximum Error [" + unit + "]"]],
+                                           [error[rows].min(), error[rows].mean(), error[rows].max()])
+
+            failing             = df[rows & fail].assign(Quadrant=name)
+            failing["Error / Limit"] = np.minimum(nm / limit_nm, pc / limit_pc)[rows & fail]
+            expected_violators.append(failing.sort_values("Error / Limit", ascending=False, kind="stable").head(top))
+
+        expected = pd.concat(expected_violators)[list(violators.columns)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(violators, expected, check_dtype=False)
+
+@pytest.mark.parametrize("n", [3, 7, 50, 300])
+def test_grid_weights(rng, n):
+    for _ in range(10):
+        points  = rng.normal(size=(n, 2)) if n > 3 else np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+        values  = rng.normal(size=n)
+        tri     = Delaunay(points)
+        grid    = rng.integers(2, 30)
+        xi, yi, nodes, vertices, weights, inside = utils.grid_weights(tri, grid)
+
+        expected = LinearNDInterpolator(tri, values)(nodes)
+        assert (inside == ~np.isnan(expected)).all()
+        np.testing.assert_allclose((values[vertices] * weights).sum(axis=1)[inside], expected[inside], atol=1e-9)
+        np.testing.assert_allclose(weights[inside].sum(axis=1), 1)
+
+@pytest.mark.parametrize("n", sizes)
+def test_lattice_index(rng, n):
+    for _ in range(50):
+        x, y        = rng.integers(0, rng.integers(1, 6), (2, n)) * 0.5
+        occupancy   = rng.choice([0, 0.5, 1])
+        lattice     = utils.lattice_index(x, y, occupancy)
+
+        xs, ys      = sorted(set(x)), sorted(set(y))
+        cells       = set(zip(x, y))
+        if len(xs) < 2 or len(ys) < 2 or len(cells) < occupancy * len(xs) * len(ys):
+            assert lattice is None
+            continue
+
+        xi, yi, col, row = lattice
+        assert list(xi) == xs and list(yi) == ys
+        assert (xi[col] == x).all() and (yi[row] == y).all()
+
+def _reference_error_analysis(df, check, columns, top):
+    t_to_analyse, error_nm, error_pc, limit_nm, limit_pc, unit = check
+    error, other, limit = (error_nm, error_pc, limit_nm) if unit == "Nm" else (error_pc, error_nm, limit_pc)
+    boundary    = limit_nm/(limit_pc/100)
+    in_region   = df[t_to_analyse].abs() <= boundary if unit == "Nm" else df[t_to_analyse].abs() > boundary
+    violation   = df[error].abs() > limit
+
+    #Largest absolute value first, NaN last, ties kept in row order
+    ordered = df.assign(key_error=-df[error].abs(), key_other=-df[other].abs())
+    if violation.any():
+        if (violation & in_region).any():
+            rows, flag = ordered[violation & in_region].sort_values("key_error", kind="stable"), False
+        else:
+            rows, flag = ordered[in_region if unit == "Nm" else violation].sort_values("key_error", kind="stable").head(top), True
+    else:
+        rows, flag = ordered.sort_values(["key_error", "key_other"], kind="stable").head(top), True
+
+    return rows.filter([error, other] + columns), flag
+
+@pytest.mark.parametrize("n", sizes)
+def test_error_analysis(rng, n):
+    columns = ["Speed", "Torque"]
+    for _ in range(20):
+        df      = pd.DataFrame({"Speed": rng.integers(-3, 4, n).astype(float), "Torque": rng.integers(-40, 41, n).astype(float),
+                                "Error Nm": _errors(rng, n), "Error %": _errors(rng, n)})
+        limit   = float(rng.integers(1, 7))
+        checks  = [("Torque", "Error Nm", "Error %", limit, 10.0, "Nm"), ("Torque", "Error Nm", "Error %", limit, 10.0, "%")]
+
+        for check, (table, minimum, average, maximum, flag) in zip(checks, error_analysis(df, checks, columns, top=3)):
+            expected, expected_flag = _reference_error_analysis(df, check, columns, 3)
+            error                   = table.columns[0]
+            worst                   = expected[error].abs().dropna()
+
+            assert flag == expected_flag
+            pd.testing.assert_frame_equal(table, expected)
+            np.testing.assert_allclose([minimum, average, maximum], [worst.min(), worst.mean(), worst.max()] if len(worst) else [np.nan] * 3)
+
+def _operating_frame(rng, n):
+    df = pd.DataFrame({"Speed": rng.normal(size=n) * 60, "Torque Demanded": rng.integers(-2, 3, n).astype(float),
+                       "Voltage": rng.normal(size=n) * 20, "Torque Measured": _errors(rng, n)})
+    df.loc[rng.random(n) < 0.05, "Torque Demanded"] = np.nan
+    return df
+
+@pytest.mark.parametrize("n", sizes)
+def test_round_operating_points(rng, n, monkeypatch):
+    for bases in [{"Speed": 50}, {"Speed": 50, "Voltage": 10}]:
+        df      = _operating_frame(rng, n)
+        keys    = ["Speed Rounded", "Torque Demanded"] + [signal + " Rounded" for signal in list(bases)[1:]]
+        spread  = ["Torque Measured", "Speed"]
+        for rows in [1, 7, 1000]:
+            monkeypatch.setattr(utils, "chunk_rows", rows)
+            means, statistics       = round_operating_points(df, "Torque Demanded", bases, spread)
+
+            groups      = df.assign(**{signal + " Rounded": base * np.round(df[signal] / base) for signal, base in bases.items()}).groupby(keys)
+            expected    = groups.mean().reset_index()
+            assert len(means) == len(expected)
+            np.testing.assert_allclose(means.to_numpy(dtype=float), expected[means.columns].to_numpy(dtype=float), rtol=1e-9, atol=1e-9)
+
+            reference   = groups.size().rename("Samples").reset_index()
+            for name in spread:
+                reference[name + " Std"] = groups[name].std().to_numpy()
+                reference[name + " Min"] = groups[name].min().to_numpy()
+                reference[name + " Max"] = groups[name].max().to_numpy()
+            np.testing.assert_allclose(statistics.to_numpy(dtype=float), reference[statistics.columns].to_numpy(dtype=float), rtol=1e-7, atol=1e-7)
+
+@pytest.mark.parametrize("n", sizes)
+def test_operating_points_merge(rng, n):
+    df      = _operating_frame(rng, n).dropna(subset=["Torque Demanded"])
+    keys    = np.round(df[["Speed", "Torque Demanded"]].to_numpy() / [50, 1]) * [50, 1]
+    values  = df[["Torque Measured", "Voltage"]].to_numpy()
+    whole   = OperatingPoints(["Speed", "Torque Demanded"], ["Torque Measured", "Voltage"], ["Voltage"])
+    whole.update(keys, values)
+
+    split   = rng.integers(0, n + 1)
+    merged  = OperatingPoints(whole.keys, whole.values, whole.spread)
+    for lo, hi in [(0, split), (split, n)]:
+        part = OperatingPoints(whole.keys, whole.values, whole.spread)
+        part.update(keys[lo:hi], values[lo:hi])
+        merged.merge(part)
+
+    for name in ["bins", "samples", "count", "sum", "sum_sq", "min", "max"]:
+        np.testing.assert_allclose(getattr(merged, name), getattr(whole, name), rtol=1e-12, atol=1e-9)
@@ -1,11 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import time
 
 from src.layout import report_details, limits,  limit_format
-from src.utils import load_dataframe, col_removal, determine_transients, sample_transients, transient_removal, round_speeds, torque_error_calc, error_nm_analysis, error_pc_analysis, z_col_or_grid
-from src.plotter import demanded_plot, transient_removal_plot, plot_3D, plot_pie, plot_bowtie
+from src.utils import load_columns, load_dataframe, col_removal, time_seconds, sample_rate, decimate, determine_transients, settle_segments, dwell_sweep, sample_transients, transient_removal, segment_reduce, round_operating_points, voltage_accuracy, quadrant_accuracy, torque_error_calc, error_analysis, build_limit_index, lattice_index, max_grid_res
+from src.ingest import read_preview
+from src.downsample import density_grid
+from src.pipeline import stage
+from src.report import report_key, start_report, discard_report, report_data
+from src.plotter import demanded_plot, transient_removal_plot, dwell_sweep_plot, plot_3D, plot_pie, plot_limit_sensitivity, plot_bowtie
 from src.colors import sequential_color_dict, diverging_color_dict, plot_color_set
-from src.symbols import symbol_auto_select, speed_rpm_symbols, t_demanded_symbols, t_measured_symbols, t_estimated_signals, vdc_symbols,idc_symbols
+from src.symbols import symbol_auto_select, speed_rpm_symbols, t_demanded_symbols, t_measured_symbols, t_estimated_signals, vdc_symbols,idc_symbols, time_symbols
 import plotly.graph_objects as go
 
 page_config = st.set_page_config(
@@ -30,7 +36,9 @@ t_measured              = "Torque Measured [Nm]"
 speed                   = "Speed [rpm]"
 speed_round             = "Speed [rpm] Rounded"
 vdc                     = "DC Voltage [V]"
+vdc_round               = "DC Voltage [V] Rounded"
 idc                     = "DC Current [A]"
+timestamp               = "Time [s]"
 t_demanded_error_nm     = "Torque Demanded Error [Nm]"
 t_demanded_error_pc     = "Torque Demanded Error [%]"
 t_estimated_error_nm    = "Torque Estimated Error [Nm]"
@@ -58,9 +66,9 @@ if uploaded_file == []:
 
 else:
 
-    dataframe, columns  = load_dataframe(uploaded_files=uploaded_file)
+    columns             = load_columns(uploaded_files=uploaded_file)
     if st.session_state["Sample Data"] == True:
-        st.write(dataframe.head(10))
+        st.write(read_preview(uploaded_file[0], 10))
     columns             = list(columns)
 
     columns.insert(0, "Not Selected")
@@ -97,28 +105,73 @@ st.selectbox(vdc,list(columns), key = vdc, index = symbol_auto_select(columns, v
 
 st.selectbox(idc,list(columns), key = idc, index = symbol_auto_select(columns, idc_symbols))
 
-if any(value == 'Not Selected' for value in st.session_state.values()) == True:
-    st.stop()
+#The time signal is opt in, selecting it switches dwell periods and windows from samples to seconds
+st.selectbox(timestamp,list(columns), key = timestamp, index = 0, help = "Optional, when selected dwell periods and windows are set in seconds")
+detected_time = columns[symbol_auto_select(columns, time_symbols)]
+if st.session_state[timestamp] == 'Not Selected' and detected_time != 'Not Selected':
+    st.caption("Time signal `" + detected_time + "` found: select it to set dwell periods and windows in seconds rather than samples.")
 
-selected_data = col_removal(dataframe, list(st.session_state.values()))
+if any(st.session_state[signal] == 'Not Selected' for signal in [speed, t_measured, t_demanded, t_estimated, vdc, idc] if signal in st.session_state) == True:
+    st.stop()
 
-if st.session_state["Analysis Mode"] == "Output & Estimated":
-    selected_data.rename(columns = {        
-                                        st.session_state[speed]         :speed,
-                                        st.session_state[t_measured]    :t_measured,
-                                        st.session_state[t_demanded]    :t_demanded,
-                                        st.session_state[t_estimated]   :t_estimated,
-                                        st.session_state[vdc]           :vdc,
-                                        st.session_state[idc]           :idc
-                                    }, inplace = True)
+#Dwell and tail lengths are set in samples, or in seconds when a time signal is selected
+if st.session_state[timestamp] == 'Not Selected':
+    time_signal = None
+    dwell_key   = "Dwell Period"
+    tail_key    = "Tail Samples"
+    window_key  = "Settling Window"
 else:
-    selected_data.rename(columns = {        
-                                        st.session_state[speed]         :speed,
-                                        st.session_state[t_measured]    :t_measured,
-                                        st.session_state[t_demanded]    :t_demanded,
-                                        st.session_state[vdc]           :vdc,
-                                        st.session_state[idc]           :idc
-                                    }, inplace = True)
+    time_signal = timestamp
+    dwell_key   = "Dwell Period [s]"
+    tail_key    = "Tail Time [s]"
+    window_key  = "Settling Window [s]"
+
+#Only the selected signals are parsed from the uploaded file(s)
+signals = [st.session_state[signal] for signal in [speed, t_measured, t_demanded, t_estimated, vdc, idc, timestamp] if signal in st.session_state and st.session_state[signal] != 'Not Selected']
+
+#Each stage below is keyed on its upstream key plus its own settings, and only reruns when that key changes
+with st.sidebar.expander("Pipeline Stages"):
+    pipeline_status = st.empty()
+
+def load_stage():
+    dataframe = load_dataframe(uploaded_files=uploaded_file, usecols=signals)
+
+    selected_data = col_removal(dataframe, signals)
+
+    if st.session_state["Analysis Mode"] == "Output & Estimated":
+        selected_data.rename(columns = {        
+                                            st.session_state[speed]         :speed,
+                                            st.session_state[t_measured]    :t_measured,
+                                            st.session_state[t_demanded]    :t_demanded,
+                                            st.session_state[t_estimated]   :t_estimated,
+                                            st.session_state[vdc]           :vdc,
+                                            st.session_state[idc]           :idc
+                                        }, inplace = True)
+    else:
+        selected_data.rename(columns = {        
+                                            st.session_state[speed]         :speed,
+                                            st.session_state[t_measured]    :t_measured,
+                                            st.session_state[t_demanded]    :t_demanded,
+                                            st.session_state[vdc]           :vdc,
+                                            st.session_state[idc]           :idc
+                                        }, inplace = True)
+
+    if time_signal is not None:
+        selected_data.rename(columns = {st.session_state[timestamp] : timestamp}, inplace = True)
+        selected_data = time_seconds(selected_data, timestamp)
+
+    return selected_data
+
+load_key      = (tuple((file.name, file.size, getattr(file, "file_id", None)) for file in uploaded_file), tuple(signals), st.session_state["Analysis Mode"])
+selected_data = stage("Load", load_key, load_stage, pipeline_status)
+
+st.number_input("Decimation Factor", min_value=1, max_value=100, value=1, step=1, help="Low pass filter and keep every Nth sample before analysis, i.e. a factor of 10 takes a 10 kHz log to 1 kHz", key = "Decimation Factor")
+dataset_key = (load_key, st.session_state["Decimation Factor"])
+if st.session_state["Decimation Factor"] > 1:
+    with st.spinner("Decimating data"):
+        selected_data = stage("Decimate", dataset_key, lambda: decimate(selected_data, st.session_state["Decimation Factor"], t_demanded, time_signal), pipeline_status)
+if time_signal is not None:
+    st.write("Sample rate after decimation: `" + str(round(sample_rate(selected_data, timestamp), 1)) + " Hz`")
 
 
 
@@ -130,31 +183,89 @@ st.header("Remove Transients - (*Optional*)")
 with st.spinner("Generating transient removal tool"):
 
     st.write("Make sure the transient removal process is removing the required data; when there is a step change and time taken until steady state is reached.")
-    st.markdown("If this is not achieved, adjust the variable `Dwell Period` using the slider below")
+    st.markdown("If this is not achieved, adjust the variable `Dwell Period` using the slider below, or use the `Adaptive` dwell mode to detect where each step settles")
     st.markdown("Scan through torque steps using the `Sample` slider to determine if the `Dwell Period` is appropiate for the range of torque steps.")
 
+    st.radio("Dwell Mode", ["Fixed", "Adaptive"], key = "Dwell Mode")
     dwell_col, sample_col, t_d_filter_col = st.columns(3)
-    dwell_col.slider("Dwell Period", min_value=0, max_value=2000, step=1, value= 500, key = "Dwell Period")
+    if st.session_state["Dwell Mode"] == "Fixed":
+        if time_signal is None:
+            dwell_col.slider("Dwell Period", min_value=0, max_value=2000, step=1, value= 500, key = dwell_key)
+        else:
+            dwell_col.slider("Dwell Period [s]", min_value=0.0, max_value=10.0, step=0.01, value= 0.5, key = dwell_key)
+        dwell_params = (st.session_state[dwell_key],)
+    else:
+        dwell_col.number_input("Settling Band [Nm]", min_value=0.0, max_value=100.0, step=0.1, value=1.0, help="Measured torque is settled once it stays within this band of its final value for the step", key = "Settling Band")
+        if time_signal is None:
+            dwell_col.number_input("Settling Window", min_value=1, max_value=5000, step=1, value=50, help="Number of samples averaged when comparing measured torque with the band", key = window_key)
+        else:
+            dwell_col.number_input("Settling Window [s]", min_value=0.001, max_value=10.0, step=0.001, value=0.05, format="%.3f", help="Time over which measured torque is averaged when comparing it with the band", key = window_key)
+        dwell_params = (st.session_state["Settling Band"], st.session_state[window_key])
     t_d_filter_col.number_input("Torque Demanded Filter", min_value=0.0,max_value=300.0,step=0.1,value=1.0,help="If torque demand is not as consistent as expected i.e. during derate, apply a threshold to ignore changes smaller than the filter",key = "Torque Demanded Filter")
 
-    Step_index, Stop_index          = determine_transients(selected_data,t_demanded,st.session_state["Torque Demanded Filter"], st.session_state["Dwell Period"]) 
+    #The segment table is only rebuilt when the dataset or transient parameters change, not when scrubbing samples
+    segments_key = (dataset_key, time_signal, st.session_state["Torque Demanded Filter"], st.session_state["Dwell Mode"], dwell_params)
+    if st.session_state["Dwell Mode"] == "Fixed":
+        segments = stage("Segments", segments_key, lambda: determine_transients(selected_data, t_demanded, st.session_state["Torque Demanded Filter"], st.session_state[dwell_key], time_signal), pipeline_status)
+    else:
+        segments = stage("Segments", segments_key, lambda: settle_segments(determine_transients(selected_data, t_demanded, st.session_state["Torque Demanded Filter"], 0, time_signal), selected_data, t_measured, st.session_state["Settling Band"], st.session_state[window_key], time_signal), pipeline_status)
     
-    sample_col.slider("Sample", min_value=1, max_value=abs(len(Stop_index)-1), step=1, value= round(abs(len(Stop_index)-1)/2), key = "Sample")
+    sample_col.slider("Sample", min_value=1, max_value=abs(len(segments.start)-1), step=1, value= round(abs(len(segments.start)-1)/2), key = "Sample")
 
 
-    transient_sample                = sample_transients(Step_index, Stop_index, selected_data, st.session_state)    
-    transient_removal_sample_plot   = transient_removal_plot(transient_sample, Step_index, Stop_index, selected_data, st.session_state,  t_demanded, t_estimated, t_measured)
-
-    selected_data = selected_data.drop(['Step_Change'], axis = 1)
+    transient_sample                = sample_transients(segments, selected_data, st.session_state, time_signal)    
+    transient_removal_sample_plot   = transient_removal_plot(transient_sample, segments, selected_data, st.session_state,  t_demanded, t_estimated, t_measured, time_signal)
 
     st.plotly_chart(transient_removal_sample_plot)
 
+    if st.session_state["Dwell Mode"] == "Fixed" and st.checkbox("Dwell Period Sweep", help="Evaluate every dwell period at once to see how much data is removed and how much torque error spread remains", key = "Dwell Period Sweep") == True:
+        #The sweep only depends on where the steps are, not on the dwell period currently set
+        sweep_key = (dataset_key, time_signal, st.session_state["Torque Demanded Filter"])
+        if time_signal is None:
+            sweep, suggested_dwell = stage("Dwell Sweep", sweep_key, lambda: dwell_sweep(segments, selected_data, t_demanded, t_measured, np.arange(0, 2001, 10)), pipeline_status)
+        else:
+            sweep, suggested_dwell = stage("Dwell Sweep", sweep_key, lambda: dwell_sweep(segments, selected_data, t_demanded, t_measured, np.round(np.arange(0, 10.001, 0.05), 2), timestamp), pipeline_status)
+        st.plotly_chart(dwell_sweep_plot(sweep, suggested_dwell, "N" if time_signal is None else "s"))
+
+        if suggested_dwell is not None:
+            def apply_dwell(dwell):
+                st.session_state[dwell_key] = dwell
+
+            st.write("Suggested `Dwell Period`: " + str(suggested_dwell))
+            st.button("Apply Suggested Dwell Period", on_click = apply_dwell, args = (suggested_dwell,))
+
+#Sample times of the segments, before transient removal drops samples
+settle_time = selected_data[timestamp].to_numpy() if time_signal is not None else None
+
 rem_trans_col1, rem_trans_col2, rem_trans_col3 = st.columns(3)
     
+removal_key = (dataset_key, "Keep")
+#Key of the samples behind the unaveraged plots, which stay the transient free samples when segments are averaged to their tail
+steady_key  = removal_key
 if rem_trans_col2.checkbox("Remove Transients", key = "Remove Transients") == True: 
-    with st.spinner("Removing Transients from data"):
-        selected_data = transient_removal(selected_data, Step_index, Stop_index)
-        st.success(str(len(Stop_index)-1) + " Transients Removed")
+    rem_trans_col2.checkbox("Average Segment Tail", help="Reduce each torque step to the average of its last steady state samples before rounding", key = "Average Segment Tail")
+    if st.session_state["Average Segment Tail"] == True:
+        if time_signal is None:
+            rem_trans_col2.number_input("Tail Samples", min_value=1, max_value=100000, step=1, value=500, key = tail_key)
+        else:
+            rem_trans_col2.number_input("Tail Time [s]", min_value=0.01, max_value=100.0, step=0.01, value=0.5, key = tail_key)
+        with st.spinner("Averaging steady state segments"):
+            removal_key   = (segments_key, "Tail", st.session_state[tail_key])
+            steady_key    = (segments_key, "Remove")
+            segment_data  = selected_data
+            selected_data = stage("Transient Removal", removal_key, lambda: segment_reduce(selected_data, segments, st.session_state[tail_key], time_signal), pipeline_status)
+            st.success(str(len(selected_data)) + " Steady State Segments Averaged")
+    else:
+        with st.spinner("Removing Transients from data"):
+            removal_key   = (segments_key, "Remove")
+            steady_key    = removal_key
+            selected_data = stage("Transient Removal", removal_key, lambda: transient_removal(selected_data, segments), pipeline_status)
+            st.success(str(len(segments.start)) + " Transients Removed")
+    if st.session_state["Dwell Mode"] == "Adaptive":
+        if time_signal is None:
+            st.write("Mean settling period: " + str(round(float((segments.stop - segments.start).mean()), 1)) + " samples")
+        else:
+            st.write("Mean settling period: " + str(round(float((settle_time[np.minimum(segments.stop, len(settle_time) - 1)] - settle_time[segments.start]).mean()), 3)) + " s")
 
 
 
@@ -166,13 +277,28 @@ st.header("Round Test Point Variables")
 st.subheader("Speed")
 st.number_input("Base", min_value=1, max_value=5000, value=50, step=1, key = "Speed Base")
 round_spd_col1, round_spd_col2, round_spd_col3 = st.columns(3)
-if round_spd_col2   .checkbox("Round Speed", key = "Round Speed") == True:
-    selected_data = round_speeds(selected_data, speed, t_demanded, st.session_state["Speed Base"])
-    number_of_rounded_speeds = len((selected_data[speed_round]).unique())
-    st.success(str(number_of_rounded_speeds) + " Unique Speed Points Found")
-else:
+if round_spd_col2   .checkbox("Round Speed", key = "Round Speed") == False:
     st.stop()
 st.subheader("Voltage")
+st.number_input("Base", min_value=1, max_value=1000, value=10, step=1, key = "Voltage Base")
+round_vdc_col1, round_vdc_col2, round_vdc_col3 = st.columns(3)
+round_vdc_col2.checkbox("Round Voltage", key = "Round Voltage")
+
+rounding_bases = {speed: st.session_state["Speed Base"]}
+if st.session_state["Round Voltage"] == True:
+    rounding_bases[vdc] = st.session_state["Voltage Base"]
+
+steady_data   = selected_data
+rounding_key  = (removal_key, tuple(rounding_bases.items()))
+selected_data, operating_point_spread = stage("Rounding", rounding_key, lambda: round_operating_points(selected_data, t_demanded, rounding_bases, [t_measured, speed]), pipeline_status)
+number_of_rounded_speeds = len((selected_data[speed_round]).unique())
+st.success(str(number_of_rounded_speeds) + " Unique Speed Points Found")
+if st.session_state["Round Voltage"] == True:
+    number_of_rounded_voltages = len((selected_data[vdc_round]).unique())
+    st.success(str(number_of_rounded_voltages) + " Unique Voltage Points Found")
+with st.expander("Operating Point Spread"):
+    st.write("Number of samples averaged into each operating point, with the standard deviation, minimum and maximum of measured torque and speed within it.")
+    st.dataframe(operating_point_spread)
 
 
 st.markdown("---") 
@@ -195,12 +321,21 @@ st.markdown("---")
 st.header("Torque Output Accuracy")
 st.write("Minimum, Mean and Maximum errors are absoluted.")
 with st.spinner("Calculating errors..."):
-    selected_data = torque_error_calc(selected_data, t_demanded, t_estimated, t_measured, t_demanded_error_nm, t_demanded_error_pc, t_estimated_error_nm, t_estimated_error_pc)
+    #Errors are added to a copy, the rounded data is reused by later reruns
+    selected_data = stage("Errors", rounding_key, lambda: torque_error_calc(selected_data.copy(), t_demanded, t_estimated, t_measured, t_demanded_error_nm, t_demanded_error_pc, t_estimated_error_nm, t_estimated_error_pc), pipeline_status)
+    error_checks  = [
+                    (t_demanded,  t_demanded_error_nm,  t_demanded_error_pc,  st.session_state["Output Limit [Nm]"],    st.session_state["Output Limit [%]"],    "Nm"),
+                    (t_demanded,  t_demanded_error_nm,  t_demanded_error_pc,  st.session_state["Output Limit [Nm]"],    st.session_state["Output Limit [%]"],    "%"),
+                    (t_estimated, t_estimated_error_nm, t_estimated_error_pc, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], "Nm"),
+                    (t_estimated, t_estimated_error_nm, t_estimated_error_pc, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], "%"),
+                    ]
+    analysis_key  = (rounding_key, tuple(error_checks))
+    t_d_nm_results, t_d_pc_results, t_e_nm_results, t_e_pc_results = stage("Error Analysis", analysis_key, lambda: error_analysis(selected_data, error_checks, [t_measured, t_demanded, t_estimated, speed_round, vdc, idc]), pipeline_status)
 
 st.subheader("Newton Meter Error")
 st.write("Limit: " + "`± "+str(st.session_state["Output Limit [Nm]"]) + " Nm`")
 with st.spinner("Generating Torque Output [Nm] Accuracy Table"):
-    t_demanded_error_table_nm, min_error_demanded_nm, average_error_demanded_nm, max_error_demanded_nm, t_d_nm_flag = error_nm_analysis(selected_data, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"], t_demanded, t_demanded, t_estimated, t_measured, speed_round, vdc, idc, t_demanded_error_nm, t_demanded_error_pc)
+    t_demanded_error_table_nm, min_error_demanded_nm, average_error_demanded_nm, max_error_demanded_nm, t_d_nm_flag = t_d_nm_results
     
     if t_d_nm_flag == True:
         st.write("✔️ No torque error (Nm) resulted in surpassing the limits")
@@ -230,12 +365,10 @@ with st.spinner("Generating Torque Output [Nm] Accuracy Table"):
 
     st.write(t_demanded_error_table_nm)
 
-    t_demanded_error_table_nm_html= t_demanded_error_table_nm.to_html()
-
 st.subheader("Percentage Error")
 with st.spinner("Generating Torque Output [%] Accuracy Table"):
     st.write("Limit: " + "`± "+str(st.session_state["Output Limit [%]"]) + " %`")
-    t_demanded_error_table_pc, min_error_demanded_pc, average_error_demanded_pc, max_error_demanded_pc, t_d_pc_flag = error_pc_analysis(selected_data, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"], t_demanded, t_demanded, t_estimated, t_measured, speed_round, vdc, idc, t_demanded_error_nm, t_demanded_error_pc)
+    t_demanded_error_table_pc, min_error_demanded_pc, average_error_demanded_pc, max_error_demanded_pc, t_d_pc_flag = t_d_pc_results
     
     if t_d_pc_flag == True:
         st.write("✔️ No torque error (%) resulted in surpassing the limits")
@@ -266,7 +399,8 @@ with st.spinner("Generating Torque Output [%] Accuracy Table"):
 
     st.write(t_demanded_error_table_pc)
 
-dem_pie = plot_pie(selected_data, selected_data["Torque Demanded Error [Nm]"], selected_data["Torque Demanded Error [%]"], st.session_state["Output Limit [Nm]"],  st.session_state["Output Limit [%]"])
+dem_index = build_limit_index(selected_data, t_demanded_error_nm, t_demanded_error_pc)
+dem_pie = plot_pie(dem_index, st.session_state["Output Limit [Nm]"],  st.session_state["Output Limit [%]"])
 st.plotly_chart(dem_pie)
 
 
@@ -282,7 +416,7 @@ st.subheader("Newton Meter Error")
 with st.spinner("Generating Torque Estimated [Nm] Accuracy Table"):
     st.write("Limit: " + "`± "+str(st.session_state["Estimated Limit [Nm]"]) + " Nm`")
 
-    t_estimated_error_table_nm, min_error_estimated_nm, average_error_estimated_nm, max_error_estimated_nm, t_e_nm_flag = error_nm_analysis(selected_data, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], t_estimated, t_demanded, t_estimated, t_measured, speed_round, vdc, idc, t_estimated_error_nm, t_estimated_error_pc)
+    t_estimated_error_table_nm, min_error_estimated_nm, average_error_estimated_nm, max_error_estimated_nm, t_e_nm_flag = t_e_nm_results
 
     if t_e_nm_flag == True:
         st.write("✔️ No torque error (Nm) resulted in surpassing the limits")
@@ -317,7 +451,7 @@ st.subheader("Percentage Error")
 with st.spinner("Generating Torque Estimated [%] Accuracy Table"):
     st.write("Limit: " + "`± "+str(st.session_state["Estimated Limit [%]"]) + " %`")
 
-    t_estimated_error_table_pc, min_error_estimated_pc, average_error_estimated_pc, max_error_estimated_pc, t_e_pc_flag = error_pc_analysis(selected_data, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], t_estimated, t_demanded, t_estimated, t_measured, speed_round, vdc, idc, t_estimated_error_nm, t_estimated_error_pc)
+    t_estimated_error_table_pc, min_error_estimated_pc, average_error_estimated_pc, max_error_estimated_pc, t_e_pc_flag = t_e_pc_results
     
     if t_e_pc_flag == True:
         st.write("✔️ No torque error (%) resulted in surpassing the limits")
@@ -348,9 +482,40 @@ with st.spinner("Generating Torque Estimated [%] Accuracy Table"):
 
     st.write(t_estimated_error_table_pc)
 
-est_pie = plot_pie(selected_data, selected_data["Torque Estimated Error [Nm]"], selected_data["Torque Estimated Error [%]"], st.session_state["Estimated Limit [Nm]"],  st.session_state["Estimated Limit [%]"])
+est_index = build_limit_index(selected_data, t_estimated_error_nm, t_estimated_error_pc)
+est_pie = plot_pie(est_index, st.session_state["Estimated Limit [Nm]"],  st.session_state["Estimated Limit [%]"])
 st.plotly_chart(est_pie)
 
+with st.expander("Limit Sensitivity"):
+    st.write("Pass rate of the operating points as the Nm and % limits are scaled together, from zero to three times the set limits.")
+    limit_scales = np.linspace(0, 3, 151)
+    st.plotly_chart(plot_limit_sensitivity  (
+                                            {
+                                            "Torque Output"     : (dem_index.sensitivity(st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"], limit_scales), st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"]),
+                                            "Torque Estimated"  : (est_index.sensitivity(st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], limit_scales), st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"]),
+                                            },
+                                            limit_scales
+                                            ))
+
+st.markdown("---")
+st.header("Accuracy per Quadrant")
+st.write("Quadrants are classified from the signs of rounded speed and torque. Errors are absoluted. As in the pass/fail charts, a point passes when both its Nm and % errors are within the limits and fails when both are outside. Up to five of the worst failing points of each quadrant are listed below its statistics.")
+st.subheader("Torque Output")
+dem_quadrant_table, dem_quadrant_violators = stage("Output Quadrants", analysis_key, lambda: quadrant_accuracy(selected_data, speed_round, t_demanded, t_demanded_error_nm, t_demanded_error_pc, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"]), pipeline_status)
+st.write(dem_quadrant_table)
+st.write(dem_quadrant_violators)
+st.subheader("Torque Estimated")
+est_quadrant_table, est_quadrant_violators = stage("Estimated Quadrants", analysis_key, lambda: quadrant_accuracy(selected_data, speed_round, t_estimated, t_estimated_error_nm, t_estimated_error_pc, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"]), pipeline_status)
+st.write(est_quadrant_table)
+st.write(est_quadrant_violators)
+
+if st.session_state["Round Voltage"] == True:
+    st.markdown("---")
+    st.header("Accuracy per Voltage")
+    st.write("Absolute mean and maximum errors of the operating points at each rounded voltage.")
+    voltage_table = stage("Voltage Accuracy", rounding_key, lambda: voltage_accuracy(selected_data, vdc_round, [t_demanded_error_nm, t_demanded_error_pc, t_estimated_error_nm, t_estimated_error_pc]), pipeline_status)
+    st.write(voltage_table)
+
 
 st.markdown("---")
 
@@ -367,6 +532,10 @@ if 'plot_estimated_error_nm' not in st.session_state:
     st.session_state.plot_estimated_error_nm = False
 if 'plot_estimated_error_pc' not in st.session_state:
     st.session_state.plot_estimated_error_pc = False
+if 'plot_demanded_error_bowtie' not in st.session_state:
+    st.session_state.plot_demanded_error_bowtie = False
+if 'plot_estimated_error_bowtie' not in st.session_state:
+    st.session_state.plot_estimated_error_bowtie = False
 
 t_d_error_nm_plot1, t_d_error_nm_plot2, t_d_error_nm_plot3, col_preview = st.columns(4)
 t_d_error_nm_plot1.selectbox("Chart Type", ["Bowtie","Contour", "Surface","Heatmap","3D Scatter"], key = "T_d_error_chart_type" )
@@ -400,6 +569,37 @@ t_d_error_nm_plot4, t_d_error_nm_plot5, t_d_error_nm_plot6 = st.columns(3)
 t_d_error_nm_plot4.selectbox("Fill", ["NaN", "0"], key = "T_d_error_chart_fill" )
 t_d_error_nm_plot5.selectbox("Method", ["linear", "cubic"], key = "T_d_error_chart_method" )
 t_d_error_nm_plot6.number_input("Grid Resolution",  min_value = float(-500.0), max_value = float(500.0), value = float(50.0), step = float(1.0), key = "T_d_error_chart_grid")
+if st.session_state["T_d_error_chart_type"] in ["Contour", "Surface", "Heatmap"] and st.session_state["T_d_error_chart_grid"] > max_grid_res:
+    st.caption("Grids are limited to " + str(max_grid_res) + " points per axis to keep the page responsive, zoom in below to refine a region.")
+
+zoom_ranges = dict()
+with st.expander("Zoom"):
+    st.write("Restrict the Contour, Surface and Heatmap grids to a region, the full grid resolution is then spent on that region.")
+    for zoom_signal in [speed_round, t_demanded]:
+        zoom_min, zoom_max = float(selected_data[zoom_signal].min()), float(selected_data[zoom_signal].max())
+        if zoom_min < zoom_max:
+            #The slider is initialised through session state only: to the full range at first, and again whenever the stored zoom does not fit the current data
+            zoom_value = st.session_state.get("Zoom " + zoom_signal, (zoom_min, zoom_max))
+            if "Zoom " + zoom_signal not in st.session_state or not (zoom_min <= zoom_value[0] <= zoom_value[1] <= zoom_max):
+                st.session_state["Zoom " + zoom_signal] = (zoom_min, zoom_max)
+            st.slider(zoom_signal, min_value = zoom_min, max_value = zoom_max, key = "Zoom " + zoom_signal)
+            if st.session_state["Zoom " + zoom_signal] != (zoom_min, zoom_max):
+                zoom_ranges[zoom_signal] = st.session_state["Zoom " + zoom_signal]
+
+zoom_speed, zoom_torque = zoom_ranges.get(speed_round), zoom_ranges.get(t_demanded)
+#Settings of the Contour, Surface and Heatmap grids, shared by the accuracy charts
+grid_settings = dict(
+                    x           = speed_round,
+                    y           = t_demanded,
+                    fill        = st.session_state["T_d_error_chart_fill"],
+                    method      = st.session_state["T_d_error_chart_method"],
+                    grid_res    = st.session_state["T_d_error_chart_grid"],
+                    x_range     = zoom_speed,
+                    y_range     = zoom_torque
+                    )
+on_lattice = lattice_index(selected_data[speed_round], selected_data[t_demanded]) is not None
+if on_lattice == True and st.session_state["T_d_error_chart_type"] in ["Contour", "Surface", "Heatmap"]:
+    st.info("The operating points form a grid of rounded speeds and demanded torques, so they are plotted as measured: Method and Grid Resolution are not used.")
 st.subheader("Data Overlay")
 if st.checkbox("Show Data Overlayed"):
     overlay = True
@@ -408,80 +608,80 @@ else:
 t_d_error_nm_ovr1, t_d_error_nm_ovr2 = st.columns(2)
 t_d_error_nm_ovr1.slider("Opacity",value=0.5,min_value=0.0, max_value=1.0, step=0.01, key = "T_d_error_overlay_opacity")
 t_d_error_nm_ovr2.color_picker("Overlay Color", key = "T_d_error_overlay_color")
+st.radio("Overlay and Bowtie Data", ["Averaged", "Unaveraged Density"], key = "Plot Data", horizontal = True, help = "Unaveraged data is drawn as a density of the steady state samples, before any segment or operating point averaging, rather than one marker per sample")
+
+if st.session_state["Plot Data"] == "Unaveraged Density":
+    if steady_key != removal_key:
+        steady_data = stage("Steady Samples", steady_key, lambda: transient_removal(segment_data, segments), pipeline_status)
+    unaveraged_data = stage("Unaveraged Errors", steady_key, lambda: torque_error_calc(steady_data[[speed, t_demanded, t_estimated, t_measured]].copy(), t_demanded, t_estimated, t_measured, t_demanded_error_nm, t_demanded_error_pc, t_estimated_error_nm, t_estimated_error_pc), pipeline_status)
+    overlay_density = stage("Overlay Density", steady_key, lambda: density_grid(unaveraged_data[speed], unaveraged_data[t_demanded]), pipeline_status)
+else:
+    unaveraged_data = None
+    overlay_density = None
 
 if (st.session_state["plot_demanded_error_bowtie"] == True) and (st.session_state["T_d_error_chart_type"] == "Bowtie"):
-    td_bowtie = plot_bowtie(selected_data,t_demanded, t_demanded_error_nm,t_demanded_error_pc, t_measured,speed_round, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"])
+    if unaveraged_data is None:
+        td_bowtie = plot_bowtie(selected_data,t_demanded, t_demanded_error_nm,t_demanded_error_pc, t_measured,speed_round, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"])
+    else:
+        td_bowtie = plot_bowtie(unaveraged_data,t_demanded, t_demanded_error_nm,t_demanded_error_pc, t_measured,speed, st.session_state["Output Limit [Nm]"], st.session_state["Output Limit [%]"], density = True)
     st.plotly_chart(td_bowtie)
     td_bowtie_html_string = '''<br><h4> Torque Demanded Error [Nm] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>'''
-    td_bowtie_html_plot = td_bowtie.to_html(default_width = "1200px",default_height = "720px")
 else:
     td_bowtie_html_string = ""
-    td_bowtie_html_plot = ""
+    td_bowtie = None
 
 
 if (st.session_state["plot_estimated_error_bowtie"] == True) and (st.session_state["T_d_error_chart_type"] == "Bowtie"):
-    te_bowtie = plot_bowtie(selected_data, t_estimated, t_estimated_error_nm,t_estimated_error_pc, t_measured,speed_round, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"])
+    if unaveraged_data is None:
+        te_bowtie = plot_bowtie(selected_data, t_estimated, t_estimated_error_nm,t_estimated_error_pc, t_measured,speed_round, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"])
+    else:
+        te_bowtie = plot_bowtie(unaveraged_data, t_estimated, t_estimated_error_nm,t_estimated_error_pc, t_measured,speed, st.session_state["Estimated Limit [Nm]"], st.session_state["Estimated Limit [%]"], density = True)
     st.plotly_chart(te_bowtie)
     te_bowtie_html_string = '''<br><h4> Torque Estimated Error [Nm] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>'''
-    te_bowtie_html_plot = te_bowtie.to_html(default_width = "1200px",default_height = "720px")
 else:
     te_bowtie_html_string = ""
-    te_bowtie_html_plot = ""
+    te_bowtie = None
 
 if st.session_state["plot_demanded_error_nm"] == True:
     with st.spinner("Generating Plot"):
-        x_td_nm_formatted, y_td_nm_formatted, z_td_nm_formatted = z_col_or_grid(st.session_state["T_d_error_chart_type"],  st.session_state["T_d_error_chart_fill"],  st.session_state["T_d_error_chart_method"],  st.session_state["T_d_error_chart_grid"], selected_data["Speed [rpm] Rounded"],selected_data["Torque Demanded [Nm]"], selected_data["Torque Demanded Error [Nm]"])
-        t_d_error_nm_plot = plot_3D(selected_data, speed_round,t_demanded,t_demanded_error_nm,x_td_nm_formatted, y_td_nm_formatted, z_td_nm_formatted, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"])
+        t_d_error_nm_plot = plot_3D(selected_data, speed_round,t_demanded,t_demanded_error_nm, grid_settings, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"], overlay_density)
         st.plotly_chart(t_d_error_nm_plot)
  
         t_d_error_nm_html_string = '''<br><h4> Torque Demanded Error [Nm] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>'''
-
-        t_d_error_nm_html_plot = t_d_error_nm_plot.to_html(default_width = "1200px",default_height = "720px")
 else:
     t_d_error_nm_html_string = ""
-    t_d_error_nm_html_plot = ""
+    t_d_error_nm_plot = None
 
 if st.session_state["plot_demanded_error_pc"] == True:
     with st.spinner("Generating Plot"):
-        x_td_pc_formatted, y_td_pc_formatted, z_td_pc_formatted = z_col_or_grid(st.session_state["T_d_error_chart_type"],  st.session_state["T_d_error_chart_fill"],  st.session_state["T_d_error_chart_method"],  st.session_state["T_d_error_chart_grid"], selected_data["Speed [rpm] Rounded"],selected_data["Torque Demanded [Nm]"], selected_data["Torque Demanded Error [%]"])
-        t_d_error_pc_plot = plot_3D(selected_data, speed_round,t_demanded,t_demanded_error_pc,x_td_pc_formatted, y_td_pc_formatted, z_td_pc_formatted, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"])
+        t_d_error_pc_plot = plot_3D(selected_data, speed_round,t_demanded,t_demanded_error_pc, grid_settings, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"], overlay_density)
         st.plotly_chart(t_d_error_pc_plot)
 
         t_d_error_pc_html_string = '''<br><h4> Torque Demanded Error [%] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>
         <br>'''
-
-        t_d_error_pc_html_plot = t_d_error_pc_plot.to_html(default_width = "1200px",default_height = "720px")
 else:
     t_d_error_pc_html_string = ""
-    t_d_error_pc_html_plot = ""
+    t_d_error_pc_plot = None
 
 if st.session_state["plot_estimated_error_nm"] == True:
     with st.spinner("Generating Plot"):
-        x_te_nm_formatted, y_te_nm_formatted, z_te_nm_formatted = z_col_or_grid(st.session_state["T_d_error_chart_type"],  st.session_state["T_d_error_chart_fill"],  st.session_state["T_d_error_chart_method"],  st.session_state["T_d_error_chart_grid"], selected_data["Speed [rpm] Rounded"],selected_data["Torque Demanded [Nm]"], selected_data["Torque Estimated Error [Nm]"])
-        t_e_error_nm_plot = plot_3D(selected_data, speed_round,t_estimated,t_estimated_error_nm,x_te_nm_formatted, y_te_nm_formatted, z_te_nm_formatted, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"])
+        t_e_error_nm_plot = plot_3D(selected_data, speed_round,t_estimated,t_estimated_error_nm, grid_settings, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"], overlay_density)
         st.plotly_chart(t_e_error_nm_plot)
 
         t_e_error_nm_html_string = '''<br><h4> Torque Estimated Error [Nm] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>
         <br>'''
-
-        t_e_error_nm_html_plot = t_e_error_nm_plot.to_html(default_width = "1200px",default_height = "720px")
 else:
     t_e_error_nm_html_string = ""
-    t_e_error_nm_html_plot = ""
 
 if st.session_state["plot_estimated_error_pc"] == True:
     with st.spinner("Generating Plot"):
-        x_te_pc_formatted, y_te_pc_formatted, z_te_pc_formatted = z_col_or_grid(st.session_state["T_d_error_chart_type"],  st.session_state["T_d_error_chart_fill"],  st.session_state["T_d_error_chart_method"],  st.session_state["T_d_error_chart_grid"], selected_data["Speed [rpm] Rounded"],selected_data["Torque Demanded [Nm]"], selected_data["Torque Estimated Error [%]"])
-        t_e_error_pc_plot = plot_3D(selected_data, speed_round,t_estimated,t_estimated_error_pc, x_te_pc_formatted, y_te_pc_formatted, z_te_pc_formatted, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"])
+        t_e_error_pc_plot = plot_3D(selected_data, speed_round,t_estimated,t_estimated_error_pc, grid_settings, st.session_state["T_d_error_chart_type"], color_palette, overlay, st.session_state["T_d_error_overlay_opacity"], st.session_state["T_d_error_overlay_color"], overlay_density)
         st.plotly_chart(t_e_error_pc_plot)
 
         t_e_error_pc_html_string = '''<br><h4> Torque Est Error [%] ''' + str(st.session_state["T_d_error_chart_type"]) + ''' </h4>
         <br>'''
-
-        t_e_error_pc_html_plot = t_e_error_pc_plot.to_html(default_width = "1200px",default_height = "720px")
 else:
     t_e_error_pc_html_string = ""
-    t_e_error_pc_html_plot = ""
 
 
 st.markdown("---")
@@ -504,16 +704,7 @@ test_dict = report_details()
 
 st.header("Report Appendix Items")
 st.checkbox("Include original dataset",help="Show orginal data as table, If large dataset could take a long time", key = "Report Appendix Full Dataset")
-
-if st.session_state["Report Appendix Full Dataset"] == True:
-    report_appendix_full = '''
-    <br><h4>Full Dataset Table</h4>
-    <br><p>The below table contains all the data uploaded.</p>
-    <br>'''+ dataframe.to_html().replace('<table border="1" class="dataframe">','<table class="table table-sm">') +'''
-    '''
-else: 
-    report_appendix_full = ""
-
+st.checkbox("Compress report", help="Download the report gzip compressed (.html.gz), most browsers open it once decompressed", key = "Report Gzip")
 
 files = []
 for file in uploaded_file:
@@ -524,14 +715,26 @@ input_files_table = input_files_table.to_html(header=False).replace('<table bord
 
 if st.session_state["Remove Transients"] == True:
     transient_removal_html = ''' 
-    <p>Dwell Period: '''+str(st.session_state["Dwell Period"])+'''</p>'''+'''
-    <p>Torque Demanded Filter : '''+str(st.session_state["Torque Demanded Filter"])+''' Nm </p>'''
+    <p>Dwell Mode: '''+str(st.session_state["Dwell Mode"])+'''</p>'''+'''
+    <p>'''+ ("Dwell Period: "+str(st.session_state[dwell_key])+(" samples" if time_signal is None else " s") if st.session_state["Dwell Mode"] == "Fixed" else "Settling Band: "+str(st.session_state["Settling Band"])+" Nm, Settling Window: "+str(st.session_state[window_key])+(" samples" if time_signal is None else " s")) +'''</p>'''+'''
+    <p>Torque Demanded Filter : '''+str(st.session_state["Torque Demanded Filter"])+''' Nm </p>'''+'''
+    <p>Decimation Factor : '''+str(st.session_state["Decimation Factor"])+'''</p>'''+'''
+    <p>'''+ ("Averaged last "+str(st.session_state[tail_key])+(" samples" if time_signal is None else " s")+" of each segment" if st.session_state["Average Segment Tail"] == True else "") +'''</p>'''
 
 else:
     transient_removal_html = ''' 
     <p>Not applied</p>
     '''
 
+if st.session_state["Round Voltage"] == True:
+    voltage_points_html = '''
+    <p>There are '''+ str(number_of_rounded_voltages)+''' unique voltage points identified (rounded to the nearest: ''' + str(st.session_state["Voltage Base"]) + ''' V).</p>
+    ''' + voltage_table.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0")
+else:
+    voltage_points_html = '''
+    <p>Voltage not rounded.</p>
+    '''
+
 if st.session_state["T_d_error_chart_type"] == "Contour":
     plot_info = '''The below contour plot(s) shows Torque against speed rounded (to the nearest: ''' + str(st.session_state["Speed Base"]) + ''' rpm) 
     <br>Data between measured data points have been interpolated between the nearest available data using the '''+ str(st.session_state["T_d_error_chart_method"])+''' method.
@@ -553,404 +756,99 @@ elif st.session_state["T_d_error_chart_type"] == "Heatmap":
     <br>Missing data has been filled with the following value: ''' + str(st.session_state["T_d_error_chart_fill"])+'''
     '''
 
-elif st.session_state["T_d_error_chart_type"] == "Scatter 3D":
+elif st.session_state["T_d_error_chart_type"] == "3D Scatter":
     plot_info = '''The below 3D Scatter plot(s) shows Torque against speed rounded (to the nearest: ''' + str(st.session_state["Speed Base"]) + ''' rpm) and Torque error'''
              
 elif st.session_state["T_d_error_chart_type"] == "Bowtie":
     plot_info = '''The bowtie plot(s) below shows the averaged torque errors and the associated error limits.'''
+    if st.session_state["Plot Data"] == "Unaveraged Density":
+        plot_info = '''The bowtie plot(s) below shows the density of unaveraged torque error samples and the associated error limits.'''
 
+if on_lattice == True and st.session_state["T_d_error_chart_type"] in ["Contour", "Surface", "Heatmap"]:
+    plot_info = plot_info.split("<br>")[0] + '''
+    <br>The data points form a grid of rounded speeds and demanded torques and are plotted as measured, without interpolation.
+    <br>Missing data has been filled with the following value: ''' + str(st.session_state["T_d_error_chart_fill"])+'''
+    '''
 
 
 
 
-html_string = '''
-<html>
-    <head>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.1/dist/css/bootstrap.min.css" rel="stylesheet" integrity="sha384-F3w7mX95PdgyTmZZMECAngseQB83DfGTowi0iMjiWaeVhAn4FJkqJByhZMI3AhiU" crossorigin="anonymous">
-        <style>body{ margin:100 100; background:white; }</style>
-    </head>
-    <body>
-        <div class="container h-10">
-            <div class="row h-10 justify-content-center align-items-center">
-            <img src="https://turntide.com/wp-content/themes/turntide2021/theme/static/images/logo-color.svg" style="width: 400px" />
-            <br>
-            </div>
-        </div>
-
-        <h1 class="display-1 text-center">Torque Accuracy Results</h1>
-
-        <br>
-
-        <!-- *** Section 1 *** --->
-        <h2>Report Details</h2>
-        <br>
-            <h4>Testing</h4>
-
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Test Name</th>
-                  <td>'''+ str(st.session_state["Test Name"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>User</th>
-                  <td>'''+ str(st.session_state["User"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Test Date</th>
-                  <td>'''+ str(st.session_state["Test Date"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Test Note</th>
-                  <td>'''+ str(st.session_state["Test Note"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-
-
-                <br>
-
-            <h4>Software</h4>
-
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Dyno</th>
-                  <td>'''+ str(st.session_state["Dyno"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Torque Speed Sensor</th>
-                  <td>'''+ str(st.session_state["Torque Speed Sensor"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Sensor Calibration Date</th>
-                  <td>'''+ str(st.session_state["Sensor Calibration Date"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-            <br>
-
-            <h4>Motor</h4>
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Software Level</th>
-                  <td>'''+ str(st.session_state["Software Level"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Software Location</th>
-                  <td>'''+ str(st.session_state["Software Location"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Software Notes</th>
-                  <td>'''+ str(st.session_state["Software Notes"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-            <br>
-
-            <h4>Controller</h4>
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Controller Manufacturer</th>
-                  <td>'''+ str(st.session_state["Controller Manufacturer"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Controller Model</th>
-                  <td>'''+ str(st.session_state["Controller Model"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Controller Sample</th>
-                  <td>'''+ str(st.session_state["Controller Sample"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Controller Notes</th>
-                  <td>'''+ str(st.session_state["Controller Notes"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-            <br>
-
-            <h4>Dyno</h4>
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Motor Manufacturer</th>
-                  <td>'''+ str(st.session_state["Motor Manufacturer"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Motor Model</th>
-                  <td>'''+ str(st.session_state["Motor Model"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Motor Sample</th>
-                  <td>'''+ str(st.session_state["Motor Sample"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Motor Notes</th>
-                  <td>'''+ str(st.session_state["Motor Notes"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-            <br>
-
-            <h4>Limits</h4>
-            <table class="table">
-              <tbody>
-                <tr>
-                <th scope="row", width = 300>Output [Nm]</th>
-                  <td>'''+ str(st.session_state["Output Limit [Nm]"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Output [%]</th>
-                  <td>'''+ str(st.session_state["Output Limit [%]"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Estimated [Nm]</th>
-                  <td>'''+ str(st.session_state["Estimated Limit [Nm]"]) + '''</td>
-                </tr>
-                <th scope="row", width = 300>Estimated [%]</th>
-                  <td>'''+ str(st.session_state["Estimated Limit [%]"]) + '''</td>
-                </tr>
-              </tbody>
-            </table>
-            <br>
-
-            <!-- *** Section 2 *** --->
-            <h2>Input Files</h2>
-                '''+ input_files_table +'''
-                <br>
-
-            <h2>Transient Removal</h2> 
-                '''+ transient_removal_html +'''
-                '''+ transient_removal_sample_plot.to_html(default_width = "1200px",default_height = "720px") +'''
-                <br>
-
-            <h2>Unique Points</h2>
-                <p>There are '''+ str(number_of_rounded_speeds)+''' unique speed points identified.</p>
-                <p>There are X unique voltage points indentified.</p>
-                <br>
-
-        <!-- *** Section 3 *** --->
-        <h2>Torque Output Accuracy</h2>
-        <p>Minimum, Mean and Maximum errors are absoluted.</p>
-
-            <br>
-            <h4>Newton Meter Error</h4>
-            <p>Limit:&plusmn'''+ str(st.session_state["Output Limit [Nm]"]) +'''Nm</p>
-            ''' + t_d_nm_flag_html + '''
-            
-            <table class="table">
-              <thead>
-                <tr>
-                  <th scope="col">Minimum</th>
-                  <th scope="col">Mean</th>
-                  <th scope="col">Maximum</th>
-                </tr>
-              </thead>
-              <tbody>
-                <tr>
-                  <td>''' + min_error_demanded_nm_display + '''</td>
-                  <td>''' + average_error_demanded_nm_display + '''</td>
-                  <td>''' + max_error_demanded_nm_display + '''</td>
-                </tr>
-              </tbody>
-            </table>
-
-            ''' + t_demanded_error_table_nm.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0") + '''
-            <br>
-            <h4>Percentage Error</h4>
-            
-            <p>Limit:&plusmn'''+ str(st.session_state["Output Limit [%]"]) +'''%</p>
-            ''' + t_d_pc_flag_html + '''
-            
-            <table class="table">
-              <thead>
-                <tr>
-                  <th scope="col">Minimum</th>
-                  <th scope="col">Mean</th>
-                  <th scope="col">Maximum</th>
-                </tr>
-              </thead>
-              <tbody>
-                <tr>
-                  <td>''' + min_error_demanded_pc_display + '''</td>
-                  <td>''' + average_error_demanded_pc_display + '''</td>
-                  <td>''' + max_error_demanded_pc_display + '''</td>
-                </tr>
-              </tbody>
-            </table>
-
-            ''' + t_demanded_error_table_pc.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0") + '''
-            <br>
-
-            <h4> Pass : Fail </h4>
-
-            <div class="container">
-            <div class="row">
-                <div class="col align-self-start">
-                
-                </div>
-                <div class="col align-self-center">
-                ''' + dem_pie.to_html(default_width = "500px",default_height = "500px") + '''
-                </div>
-                <div class="col align-self-end">
-                
-                </div>
-            </div>
-            </div> 
-
-            <br>
-
-        <h2>Torque Estimated Accuracy</h2>
-
-            <br>
-            <h4>Newton Meter Error</h4>
-            <p>Limit:&plusmn'''+ str(st.session_state["Estimated Limit [Nm]"]) +'''Nm</p>
-            ''' + t_e_nm_flag_html + '''
-            
-            <table class="table">
-              <thead>
-                <tr>
-                  <th scope="col">Minimum</th>
-                  <th scope="col">Mean</th>
-                  <th scope="col">Maximum</th>
-                </tr>
-              </thead>
-              <tbody>
-                <tr>
-                  <td>''' + min_error_estimated_nm_display + '''</td>
-                  <td>''' + average_error_estimated_nm_display + '''</td>
-                  <td>''' + max_error_estimated_nm_display + '''</td>
-                </tr>
-              </tbody>
-            </table>
-
-            '''+ t_estimated_error_table_nm.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0") +'''
-
-            <br>
-            <h4>Percentage Error</h4>
-
-            <p>Limit:&plusmn'''+ str(st.session_state["Estimated Limit [%]"]) +'''%</p>
-            ''' + t_e_pc_flag_html + '''
-            
-            <table class="table">
-              <thead>
-                <tr>
-                  <th scope="col">Minimum</th>
-                  <th scope="col">Mean</th>
-                  <th scope="col">Maximum</th>
-                </tr>
-              </thead>
-              <tbody>
-                <tr>
-                  <td>''' + min_error_estimated_pc_display + '''</td>
-                  <td>''' + average_error_estimated_pc_display + '''</td>
-                  <td>''' + max_error_estimated_pc_display + '''</td>
-                </tr>
-              </tbody>
-            </table>
-
-            '''+ t_estimated_error_table_pc.to_html(index=False, classes='table table-striped table-sm text-right', justify='center', border="0") +'''
-            <br>
-
-            <h4> Pass : Fail </h4>
-            <div class="container">
-            <div class="row">
-                <div class="col align-self-start">
-                
-                </div>
-                <div class="col align-self-center">
-                ''' + est_pie.to_html(default_width = "500px",default_height = "500px") + '''
-                </div>
-                <div class="col align-self-end">
-                
-                </div>
-            </div>
-            </div> 
-
-        <!-- *** Section 4 *** --->
-        <h2>Plots</h2>
-            <p>Selected plots will appear here.</p>  
-
-            <div class="container">
-            <div class="row">
-                <div class="col align-self-start">
-                
-                </div>
-                <div class="col align-self-center">
-                ''' + dem_pie.to_html(default_width = "500px",default_height = "500px") + '''
-                </div>
-                <div class="col align-self-end">
-                
-                </div>
-            </div>
-        </div>         
-            ''' + plot_info + '''
-  
-                    ''' + td_bowtie_html_string + '''
-            <div class="container">
-                <div class="row">
-                    <div class="col align-self-start">
-
-                    </div>
-                    <div class="col align-self-center">
-                    ''' + td_bowtie_html_plot + '''
-                    </div>
-                    <div class="col align-self-end">
-
-                    </div>
-                </div>
-            </div>
-
-            ''' + te_bowtie_html_string + '''
-            <div class="container">
-                <div class="row">
-                    <div class="col align-self-start">
-
-                    </div>
-                    <div class="col align-self-center">
-                    ''' + te_bowtie_html_plot + '''
-                    </div>
-                    <div class="col align-self-end">
-
-                    </div>
-                </div>
-            </div>
-
-            ''' + t_d_error_nm_html_string + '''
-            <div class="container">
-                <div class="row">
-                    <div class="col align-self-start">
-
-                    </div>
-                    <div class="col align-self-center">
-                    ''' + t_d_error_nm_html_plot + '''
-                    </div>
-                    <div class="col align-self-end">
-
-                    </div>
-                </div>
-            </div>
-
-            ''' + t_d_error_pc_html_string + '''
-            <div class="container">
-                <div class="row">
-                    <div class="col align-self-start">
-
-                    </div>
-                    <div class="col align-self-center">
-                    ''' + t_d_error_pc_html_plot + '''
-                    </div>
-                    <div class="col align-self-end">
-
-                    </div>
-                </div>
-            </div>
-            
-        
-        <!-- *** Section 4 *** --->
-        <br>
-        <h2>Appendix</h2>
-        <br>
-            <h4>Data analysed as Table</h4> 
-            ''' + selected_data.to_html().replace('<table border="1" class="dataframe">','<table class="table table-striped table-sm">') + '''
-            ''' + report_appendix_full + '''
-    </body>
-</html>
-'''
 
 bl, report_col ,br = st.columns(3)
 
-report_col.download_button(
-    label="Download Report",
-    data=html_string,
-    file_name="myfile.html",
-    mime="application/octet-stream"
-)
\ No newline at end of file
+#The report is only assembled when requested, in the background, and kept until any of its inputs change
+report_inputs_key   = report_key(st.session_state, load_key, overlay)
+report_job          = st.session_state.get("Report Job")
+if report_job is not None and report_job["key"] != report_inputs_key:
+    discard_report(report_job)
+    del st.session_state["Report Job"]
+    report_job = None
+
+if report_job is None and report_col.button("Generate Report", help = "Assemble the report from the current results and settings"):
+    report_job = start_report(report_inputs_key, {
+                                "state"                             : dict(st.session_state),
+                                "dataframe"                         : load_dataframe(uploaded_files=uploaded_file) if st.session_state["Report Appendix Full Dataset"] == True else None,
+                                "selected_data"                     : selected_data,
+                                "input_files_table"                 : input_files_table,
+                                "transient_removal_html"            : transient_removal_html,
+                                "transient_removal_sample_plot"     : transient_removal_sample_plot,
+                                "number_of_rounded_speeds"          : number_of_rounded_speeds,
+                                "voltage_points_html"               : voltage_points_html,
+                                "t_d_nm_flag_html"                  : t_d_nm_flag_html,
+                                "t_d_pc_flag_html"                  : t_d_pc_flag_html,
+                                "t_e_nm_flag_html"                  : t_e_nm_flag_html,
+                                "t_e_pc_flag_html"                  : t_e_pc_flag_html,
+                                "min_error_demanded_nm_display"     : min_error_demanded_nm_display,
+                                "average_error_demanded_nm_display" : average_error_demanded_nm_display,
+                                "max_error_demanded_nm_display"     : max_error_demanded_nm_display,
+                                "min_error_demanded_pc_display"     : min_error_demanded_pc_display,
+                                "average_error_demanded_pc_display" : average_error_demanded_pc_display,
+                                "max_error_demanded_pc_display"     : max_error_demanded_pc_display,
+                                "min_error_estimated_nm_display"    : min_error_estimated_nm_display,
+                                "average_error_estimated_nm_display": average_error_estimated_nm_display,
+                                "max_error_estimated_nm_display"    : max_error_estimated_nm_display,
+                                "min_error_estimated_pc_display"    : min_error_estimated_pc_display,
+                                "average_error_estimated_pc_display": average_error_estimated_pc_display,
+                                "max_error_estimated_pc_display"    : max_error_estimated_pc_display,
+                                "t_demanded_error_table_nm"         : t_demanded_error_table_nm,
+                                "t_demanded_error_table_pc"         : t_demanded_error_table_pc,
+                                "t_estimated_error_table_nm"        : t_estimated_error_table_nm,
+                                "t_estimated_error_table_pc"        : t_estimated_error_table_pc,
+                                "dem_pie"                           : dem_pie,
+                                "est_pie"                           : est_pie,
+                                "dem_quadrant_table"                : dem_quadrant_table,
+                                "est_quadrant_table"                : est_quadrant_table,
+                                "dem_quadrant_violators"            : dem_quadrant_violators,
+                                "est_quadrant_violators"            : est_quadrant_violators,
+                                "plot_info"                         : plot_info,
+                                "td_bowtie_html_string"             : td_bowtie_html_string,
+                                "td_bowtie"                         : td_bowtie,
+                                "te_bowtie_html_string"             : te_bowtie_html_string,
+                                "te_bowtie"                         : te_bowtie,
+                                "t_d_error_nm_html_string"          : t_d_error_nm_html_string,
+                                "t_d_error_nm_plot"                 : t_d_error_nm_plot,
+                                "t_d_error_pc_html_string"          : t_d_error_pc_html_string,
+                                "t_d_error_pc_plot"                 : t_d_error_pc_plot,
+                                }, st.session_state["Report Gzip"])
+    st.session_state["Report Job"] = report_job
+
+if report_job is not None:
+    if report_job["thread"].is_alive():
+        #Poll the worker: a widget change interrupts the wait with a rerun, while the report keeps building
+        report_progress = report_col.progress(0.0, text = "Generating Report")
+        while report_job["thread"].is_alive():
+            report_progress.progress(*report_job["progress"])
+            time.sleep(0.1)
+        report_progress.empty()
+
+    if report_job["error"] is not None:
+        report_col.error("Report generation failed: " + str(report_job["error"]))
+        discard_report(report_job)
+        del st.session_state["Report Job"]
+    else:
+        report_col.download_button(
+            label="Download Report",
+            data=report_data(report_job),
+            file_name=report_job["file_name"],
+            mime="application/octet-stream"
+        )